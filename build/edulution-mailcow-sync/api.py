@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from fastapi import FastAPI, Response, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from modules import Keycloak, ConfigurationStorage
@@ -11,24 +12,30 @@ class Login(BaseModel):
     username: str
     password: str
 
+# The keycloak client is blocking, so it runs in the threadpool and concurrent logins don't wait for each other
+
 @app.post("/authenticate", status_code=status.HTTP_401_UNAUTHORIZED)
-def authenticate(login: Login, response: Response):
-    if keycloak.authenticate(login.username, login.password):
+async def authenticate(login: Login, response: Response):
+    if await run_in_threadpool(keycloak.authenticate, login.username, login.password):
         response.status_code = status.HTTP_200_OK
 
 @app.get("/token/{token}", status_code=status.HTTP_401_UNAUTHORIZED)
-def authenticate(token: str, response: Response):
-    result = keycloak.checkToken(token)
+async def checkToken(token: str, response: Response):
+    result = await run_in_threadpool(keycloak.checkToken, token)
     if result:
         response.status_code = status.HTTP_200_OK
         return result
 
+@app.get("/cache/stats")
+def cacheStats():
+    return keycloak.getCacheStats()
+
 if __name__ == "__main__":
     config = ConfigurationStorage()
     config.importFromEnvironment()
 
     keycloak = Keycloak(server_url=config.KEYCLOAK_SERVER_URL, client_id=config.KEYCLOAK_CLIENT_ID, client_secret_key=config.KEYCLOAK_SECRET_KEY)
-    keycloak.initKeycloakOpenID()
+    keycloak.initKeycloakOpenID(cache_ttl=config.AUTH_CACHE_TTL, cache_size=config.AUTH_CACHE_SIZE)
 
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=5000)
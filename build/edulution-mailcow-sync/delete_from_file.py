@@ -4,6 +4,7 @@ import sys
 import os
 import logging
 import argparse
+import csv
 from modules import Mailcow, ConfigurationStorage
 
 logging.basicConfig(format='%(levelname)s: %(asctime)s %(message)s', level=logging.INFO)
@@ -13,7 +14,7 @@ class DeleteFromFile:
     CLI tool to delete mailboxes and aliases from a file containing email addresses.
 
     Usage:
-        python3 delete_from_file.py /path/to/file.txt [--force]
+        python3 delete_from_file.py /path/to/file.txt [--force] [--report report.csv]
 
     File format:
         - One email address per line
@@ -23,7 +24,9 @@ class DeleteFromFile:
 
     def __init__(self):
         self._config = self._readConfig()
-        self.mailcow = Mailcow(apiToken=self._config.MAILCOW_API_TOKEN)
+        self.mailcow = Mailcow(apiToken=self._config.MAILCOW_API_TOKEN, concurrency=self._config.MAILCOW_CONCURRENCY)
+        self.mailbox_index = {}
+        self.alias_index = {}
 
     def _readConfig(self) -> ConfigurationStorage:
         config = ConfigurationStorage()
@@ -61,29 +64,81 @@ class DeleteFromFile:
             logging.error(f"Error reading file: {e}")
             return []
 
+    def load_collections(self) -> bool:
+        """Download mailboxes and aliases once and index them by address, returns False if mailcow failed"""
+        logging.info("Loading mailboxes and aliases from mailcow...")
+        mailboxes = self.mailcow.getMailboxes()
+        aliases = self.mailcow.getAliases()
+
+        # Every address would be reported as not found with an incomplete index
+        if mailboxes is False or aliases is False:
+            logging.error("Failed to load mailboxes and aliases from mailcow, see above errors")
+            return False
+
+        mailboxes = mailboxes or []
+        aliases = aliases or []
+
+        self.mailbox_index = {mailbox.get('username', '').lower(): mailbox for mailbox in mailboxes}
+        self.alias_index = {alias.get('address', '').lower(): alias for alias in aliases}
+
+        logging.info(f"Loaded {len(self.mailbox_index)} mailboxes and {len(self.alias_index)} aliases")
+        return True
+
     def check_if_mailbox_exists(self, address: str) -> bool:
         """Check if address is a mailbox"""
-        try:
-            mailboxes = self.mailcow.getMailboxes()
-            if mailboxes:
-                for mailbox in mailboxes:
-                    if mailbox.get('username') == address:
-                        return True
-        except Exception as e:
-            logging.error(f"Error checking mailbox {address}: {e}")
-        return False
+        return address.lower() in self.mailbox_index
 
     def check_if_alias_exists(self, address: str) -> dict:
         """Check if address is an alias and return alias data"""
-        try:
-            aliases = self.mailcow.getAliases()
-            if aliases:
-                for alias in aliases:
-                    if alias.get('address') == address:
-                        return alias
-        except Exception as e:
-            logging.error(f"Error checking alias {address}: {e}")
-        return None
+        return self.alias_index.get(address.lower())
+
+    def classify_addresses(self, addresses: list) -> dict:
+        """Sort every address into mailboxes, aliases, not found, skipped or duplicates"""
+        result = {
+            'mailboxes': [],
+            'aliases': [],
+            'not_found': [],
+            'skipped': [],
+            'duplicates': {}
+        }
+
+        ignored = {mailbox.lower() for mailbox in self._config.IGNORE_MAILBOXES if mailbox}
+        seen = {}
+
+        for address in addresses:
+            if address.lower() in seen:
+                # Same address in another spelling, it is processed with its first occurrence
+                if address != seen[address.lower()]:
+                    result['duplicates'][address] = seen[address.lower()]
+                continue
+            seen[address.lower()] = address
+
+            if address.lower() in ignored:
+                result['skipped'].append(address)
+            elif self.check_if_mailbox_exists(address):
+                result['mailboxes'].append(address)
+            elif self.check_if_alias_exists(address):
+                result['aliases'].append(address)
+            else:
+                result['not_found'].append(address)
+
+        return result
+
+    def _delete_in_batches(self, items: list, delete_function, descriptor: str) -> dict:
+        """Delete items with multi-item requests and log the progress, returns the success per item"""
+        results = {}
+        step = self.mailcow.batchSize * self._config.MAILCOW_CONCURRENCY
+
+        for i in range(0, len(items), step):
+            chunk = items[i:i + step]
+            try:
+                results.update(delete_function(chunk))
+            except Exception as e:
+                logging.error(f"✗ Error deleting {descriptor}: {e}")
+                results.update({item: False for item in chunk})
+            logging.info(f"Deleted {descriptor}: {min(i + step, len(items))}/{len(items)}")
+
+        return results
 
     def delete_addresses(self, addresses: list, force: bool = False) -> dict:
         """
@@ -96,30 +151,26 @@ class DeleteFromFile:
             'aliases_deleted': 0,
             'not_found': 0,
             'errors': 0,
-            'skipped': []
+            'skipped': [],
+            'duplicates': 0,
+            'report': {}
         }
 
-        # Check what we're about to delete
-        mailboxes_to_delete = []
-        aliases_to_delete = []
-        not_found = []
+        if not self.load_collections():
+            logging.error("Aborting, nothing was deleted.")
+            stats['errors'] += 1
+            return stats
 
         logging.info("Analyzing addresses...")
-        for address in addresses:
-            # Check if it's in IGNORE list
-            if address in self._config.IGNORE_MAILBOXES:
-                logging.warning(f"SKIPPED (in IGNORE_MAILBOXES): {address}")
-                stats['skipped'].append(address)
-                continue
+        classified = self.classify_addresses(addresses)
+        mailboxes_to_delete = classified['mailboxes']
+        aliases_to_delete = classified['aliases']
+        not_found = classified['not_found']
+        stats['skipped'] = classified['skipped']
+        stats['duplicates'] = len(classified['duplicates'])
 
-            # Check if it's a mailbox
-            if self.check_if_mailbox_exists(address):
-                mailboxes_to_delete.append(address)
-            # Check if it's an alias
-            elif self.check_if_alias_exists(address):
-                aliases_to_delete.append(address)
-            else:
-                not_found.append(address)
+        for address in stats['skipped']:
+            logging.warning(f"SKIPPED (in IGNORE_MAILBOXES): {address}")
 
         # Print summary
         logging.info("")
@@ -131,6 +182,7 @@ class DeleteFromFile:
         logging.info(f"Aliases to delete: {len(aliases_to_delete)}")
         logging.info(f"Not found (will be skipped): {len(not_found)}")
         logging.info(f"Ignored (IGNORE_MAILBOXES): {len(stats['skipped'])}")
+        logging.info(f"Duplicates (processed once): {stats['duplicates']}")
         logging.info("=" * 70)
 
         if mailboxes_to_delete:
@@ -155,6 +207,16 @@ class DeleteFromFile:
 
         logging.info("=" * 70)
 
+        # Result per address in the order of the file, deletions are filled in below
+        report = stats['report']
+        status = {address: "pending" for address in mailboxes_to_delete + aliases_to_delete}
+        status.update({address: "not found" for address in not_found})
+        status.update({address: "skipped (IGNORE_MAILBOXES)" for address in stats['skipped']})
+        status.update({address: f"duplicate of {first}" for address, first in classified['duplicates'].items()})
+        for address in addresses:
+            if address in status:
+                report[address] = status[address]
+
         # Ask for confirmation unless --force is used
         if not force:
             logging.info("")
@@ -167,34 +229,38 @@ class DeleteFromFile:
         logging.info("")
         logging.info("Starting deletion...")
 
-        # Delete mailboxes
-        for mailbox in mailboxes_to_delete:
-            try:
-                if self.mailcow.deleteMailbox(mailbox):
-                    stats['mailboxes_deleted'] += 1
-                    logging.info(f"✓ Deleted mailbox: {mailbox}")
-                else:
-                    stats['errors'] += 1
-                    logging.error(f"✗ Failed to delete mailbox: {mailbox}")
-            except Exception as e:
+        # Delete mailboxes, mailcow expects the usernames as stored
+        usernames = {address: self.mailbox_index[address.lower()]['username'] for address in mailboxes_to_delete}
+        results = self._delete_in_batches(list(usernames.values()), self.mailcow.deleteMailboxes, "mailboxes")
+        for address, username in usernames.items():
+            if results.get(username):
+                stats['mailboxes_deleted'] += 1
+                report[address] = "mailbox deleted"
+            else:
                 stats['errors'] += 1
-                logging.error(f"✗ Error deleting mailbox {mailbox}: {e}")
-
-        # Delete aliases
-        for alias in aliases_to_delete:
-            try:
-                if self.mailcow.deleteAlias(alias):
-                    stats['aliases_deleted'] += 1
-                    logging.info(f"✓ Deleted alias: {alias}")
-                else:
-                    stats['errors'] += 1
-                    logging.error(f"✗ Failed to delete alias: {alias}")
-            except Exception as e:
+                report[address] = "mailbox deletion failed"
+
+        # Delete aliases, mailcow expects the alias ids
+        alias_ids = {address: self.alias_index[address.lower()]['id'] for address in aliases_to_delete}
+        results = self._delete_in_batches(list(alias_ids.values()), self.mailcow.deleteAliases, "aliases")
+        for address, alias_id in alias_ids.items():
+            if results.get(alias_id):
+                stats['aliases_deleted'] += 1
+                report[address] = "alias deleted"
+            else:
                 stats['errors'] += 1
-                logging.error(f"✗ Error deleting alias {alias}: {e}")
+                report[address] = "alias deletion failed"
 
         stats['not_found'] = len(not_found)
 
+        logging.info("")
+        logging.info("=" * 70)
+        logging.info("RESULT PER ADDRESS")
+        logging.info("=" * 70)
+        for address in report:
+            symbol = "✗" if "failed" in report[address] else "✓" if "deleted" in report[address] else "-"
+            logging.info(f"{symbol} {address}: {report[address]}")
+
         # Final summary
         logging.info("")
         logging.info("=" * 70)
@@ -204,11 +270,21 @@ class DeleteFromFile:
         logging.info(f"Aliases deleted: {stats['aliases_deleted']}/{len(aliases_to_delete)}")
         logging.info(f"Not found: {stats['not_found']}")
         logging.info(f"Skipped (IGNORE_MAILBOXES): {len(stats['skipped'])}")
+        logging.info(f"Duplicates: {stats['duplicates']}")
         logging.info(f"Errors: {stats['errors']}")
         logging.info("=" * 70)
 
         return stats
 
+    def write_report(self, report: dict, file_path: str) -> None:
+        """Write the result per address as CSV"""
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['address', 'result'])
+            for address, result in report.items():
+                writer.writerow([address, result])
+        logging.info(f"Report written to: {file_path}")
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -232,6 +308,9 @@ Usage:
   # Skip confirmation (dangerous!)
   python3 delete_from_file.py /path/to/addresses.txt --force
 
+  # Write the result per address to a CSV file
+  python3 delete_from_file.py /path/to/addresses.txt --report /path/to/report.csv
+
   # Inside Docker container
   docker exec edulution-mail python3 /sync/delete_from_file.py /srv/docker/edulution-mail/delete_list.txt
         """,
@@ -241,6 +320,8 @@ Usage:
     parser.add_argument('file', help='Path to file containing email addresses (one per line)')
     parser.add_argument('--force', '-f', action='store_true',
                        help='Skip confirmation prompt (USE WITH CAUTION!)')
+    parser.add_argument('--report', '-r',
+                       help='Write the result per address to this CSV file')
 
     args = parser.parse_args()
 
@@ -267,6 +348,9 @@ Usage:
 
         stats = deleter.delete_addresses(addresses, force=args.force)
 
+        if args.report:
+            deleter.write_report(stats['report'], args.report)
+
         # Exit with error code if there were errors
         if stats['errors'] > 0:
             sys.exit(1)
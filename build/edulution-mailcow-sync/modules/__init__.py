@@ -6,4 +6,7 @@ from .models.ListStorage import ListStorage
 from .models.ConfigurationStorage import ConfigurationStorage
 from .models.AliasListStorage import AliasListStorage
 from .models.FilterListStorage import FilterListStorage
-from .database.DeactivationTracker import DeactivationTracker
\ No newline at end of file
+from .database.DeactivationTracker import DeactivationTracker
+from .database.SyncSnapshot import SyncSnapshot
+from .cache.TTLCache import TTLCache
+from .metrics.SyncMetrics import SyncMetrics
\ No newline at end of file
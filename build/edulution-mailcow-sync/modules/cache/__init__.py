@@ -0,0 +1,3 @@
+from .TTLCache import TTLCache
+
+__all__ = ["TTLCache"]
@@ -2,132 +2,252 @@ import json
 import os
 import time
 import logging
+import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 
 class DeactivationTracker:
+
+    itemTypes = ["domains", "mailboxes", "aliases", "filters", "alias_members"]
     
     def __init__(self, storage_path="/srv/docker/edulution-mail/data", mark_count_threshold=3):
         self.storage_path = storage_path
-        self.storage_file = os.path.join(storage_path, "deactivation_tracker.json")
+        self.storage_file = os.path.join(storage_path, "deactivation_tracker.db")
+        self.legacy_storage_file = os.path.join(storage_path, "deactivation_tracker.json")
         self.mark_count_threshold = mark_count_threshold
-        self.data = {
-            "domains": {},
-            "mailboxes": {},
-            "aliases": {},
-            "filters": {},
-            "alias_members": {}
-        }
+        self._connection = None
+        self._in_transaction = False
         self.load()
     
     def load(self):
-        if os.path.exists(self.storage_file):
-            try:
-                with open(self.storage_file, 'r') as f:
-                    loaded_data = json.load(f)
+        try:
+            os.makedirs(self.storage_path, exist_ok=True)
+            self._connection = sqlite3.connect(self.storage_file)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS tracker (
+                    item_type TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    mark_count INTEGER NOT NULL DEFAULT 0,
+                    first_marked_at REAL,
+                    last_marked_at REAL,
+                    deactivated INTEGER NOT NULL DEFAULT 0,
+                    deactivated_at REAL,
+                    delete_at REAL,
+                    delete_at_readable TEXT,
+                    PRIMARY KEY (item_type, item_id)
+                )
+            """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tracker_delete_at ON tracker (item_type, deactivated, delete_at)")
+            self._connection.commit()
 
-                # Merge loaded data with default structure to ensure all keys exist
-                self.data.update(loaded_data)
+            self._importLegacyFile()
 
-                # Ensure all required keys exist (for backward compatibility)
-                if "alias_members" not in self.data:
-                    self.data["alias_members"] = {}
-                    logging.info(f"  * Added missing 'alias_members' key to tracker")
+            logging.info(f"  * Loaded deactivation tracker from {self.storage_file}")
+        except Exception as e:
+            logging.error(f"  * Failed to load deactivation tracker: {e}")
+            raise
 
-                logging.info(f"  * Loaded deactivation tracker from {self.storage_file}")
-            except Exception as e:
-                logging.error(f"  * Failed to load deactivation tracker: {e}")
+    def _importLegacyFile(self):
+        """One-time import of the former deactivation_tracker.json, the file is renamed afterwards"""
+        if not os.path.exists(self.legacy_storage_file):
+            return
+
+        # A crash while writing could leave the file corrupt, that must not stop the sync from starting
+        try:
+            with open(self.legacy_storage_file, 'r') as f:
+                legacy_data = json.load(f)
+
+            rows = []
+            for item_type, items in legacy_data.items():
+                if item_type not in self.itemTypes or not isinstance(items, dict):
+                    continue
+                for item_id, info in items.items():
+                    rows.append((
+                        item_type,
+                        str(item_id),
+                        info.get("mark_count", 0),
+                        info.get("first_marked_at"),
+                        info.get("last_marked_at"),
+                        1 if info.get("deactivated", False) else 0,
+                        info.get("deactivated_at"),
+                        info.get("delete_at"),
+                        info.get("delete_at_readable")
+                    ))
+        except Exception as e:
+            logging.error(f"  * Failed to read legacy deactivation tracker {self.legacy_storage_file}: {e}")
+            try:
+                os.replace(self.legacy_storage_file, self.legacy_storage_file + ".corrupt")
+                logging.error(f"  * Moved it to {self.legacy_storage_file}.corrupt, starting with an empty tracker")
+            except OSError as e:
+                logging.error(f"  * Failed to move {self.legacy_storage_file} aside: {e}")
+            return
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO tracker (item_type, item_id, mark_count, first_marked_at, last_marked_at, deactivated, deactivated_at, delete_at, delete_at_readable) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        count = len(rows)
+
+        os.replace(self.legacy_storage_file, self.legacy_storage_file + ".imported")
+        logging.info(f"  * Imported {count} entries from {self.legacy_storage_file} into deactivation tracker")
     
     def save(self):
+        if self._in_transaction:
+            return
         try:
-            os.makedirs(self.storage_path, exist_ok=True)
-            with open(self.storage_file, 'w') as f:
-                json.dump(self.data, f, indent=2)
+            self._connection.commit()
         except Exception as e:
             logging.error(f"  * Failed to save deactivation tracker: {e}")
+
+    def commit(self):
+        """Commit the changes collected so far, also inside a transaction"""
+        self._connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """Collect all changes inside the block and commit them at once, changes are rolled back on errors"""
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self._connection.rollback()
+            raise
+        else:
+            self._connection.commit()
+        finally:
+            self._in_transaction = False
+
+    def _getItem(self, item_type: str, item_id: str) -> dict:
+        row = self._connection.execute(
+            "SELECT * FROM tracker WHERE item_type = ? AND item_id = ?",
+            (item_type, str(item_id))
+        ).fetchone()
+        if row is None:
+            return None
+
+        info = {
+            "mark_count": row["mark_count"],
+            "deactivated": bool(row["deactivated"])
+        }
+        for key in ["first_marked_at", "last_marked_at", "deactivated_at", "delete_at", "delete_at_readable"]:
+            if row[key] is not None:
+                info[key] = row[key]
+        return info
     
     def markForDeactivation(self, item_type: str, item_id: str, grace_period_seconds: int):
-        if item_type not in self.data:
+        if item_type not in self.itemTypes:
             return False
+
+        info = self._getItem(item_type, item_id)
         
         # Initialize or increment counter
-        if item_id not in self.data[item_type]:
-            self.data[item_type][item_id] = {
+        if info is None:
+            info = {
                 "mark_count": 1,
                 "first_marked_at": time.time(),
                 "last_marked_at": time.time(),
                 "deactivated": False
             }
+            self._connection.execute(
+                "INSERT INTO tracker (item_type, item_id, mark_count, first_marked_at, last_marked_at, deactivated) VALUES (?, ?, ?, ?, ?, 0)",
+                (item_type, str(item_id), info["mark_count"], info["first_marked_at"], info["last_marked_at"])
+            )
             logging.info(f"  * First mark for {item_type} {item_id} (1/{self.mark_count_threshold})")
         else:
             # If already deactivated, don't increment counter
-            if self.data[item_type][item_id].get("deactivated", False):
+            if info.get("deactivated", False):
                 return True
             
-            current_count = self.data[item_type][item_id].get("mark_count", 0)
+            current_count = info.get("mark_count", 0)
             if current_count < self.mark_count_threshold:
-                self.data[item_type][item_id]["mark_count"] = current_count + 1
-                self.data[item_type][item_id]["last_marked_at"] = time.time()
+                info["mark_count"] = current_count + 1
+                info["last_marked_at"] = time.time()
+                self._connection.execute(
+                    "UPDATE tracker SET mark_count = ?, last_marked_at = ?, first_marked_at = COALESCE(first_marked_at, ?) WHERE item_type = ? AND item_id = ?",
+                    (info["mark_count"], info["last_marked_at"], info["last_marked_at"], item_type, str(item_id))
+                )
                 logging.info(f"  * Mark {current_count + 1}/{self.mark_count_threshold} for {item_type} {item_id}")
             
             # On threshold mark, set for actual deactivation
-            if self.data[item_type][item_id]["mark_count"] >= self.mark_count_threshold and not self.data[item_type][item_id].get("deactivated", False):
-                delete_at = time.time() + grace_period_seconds
+            if info["mark_count"] >= self.mark_count_threshold:
+                deactivated_at = time.time()
+                delete_at = deactivated_at + grace_period_seconds
                 delete_at_readable = datetime.fromtimestamp(delete_at).strftime('%Y-%m-%d %H:%M:%S')
-                
-                self.data[item_type][item_id]["deactivated"] = True
-                self.data[item_type][item_id]["deactivated_at"] = time.time()
-                self.data[item_type][item_id]["delete_at"] = delete_at
-                self.data[item_type][item_id]["delete_at_readable"] = delete_at_readable
+
+                self._connection.execute(
+                    "UPDATE tracker SET deactivated = 1, deactivated_at = ?, delete_at = ?, delete_at_readable = ? WHERE item_type = ? AND item_id = ?",
+                    (deactivated_at, delete_at, delete_at_readable, item_type, str(item_id))
+                )
                 
                 logging.info(f"  * {item_type} {item_id} marked for deletion at {delete_at_readable} after {self.mark_count_threshold} marks")
         
         self.save()
-        return self.data[item_type][item_id].get("mark_count", 0) >= self.mark_count_threshold
+        return info.get("mark_count", 0) >= self.mark_count_threshold
     
     def reactivate(self, item_type: str, item_id: str):
-        if item_type in self.data and item_id in self.data[item_type]:
+        if item_type in self.itemTypes and self._getItem(item_type, item_id) is not None:
             # Reset counter instead of deleting completely
-            self.data[item_type][item_id] = {
-                "mark_count": 0,
-                "deactivated": False
-            }
+            self._connection.execute(
+                "UPDATE tracker SET mark_count = 0, deactivated = 0, first_marked_at = NULL, last_marked_at = NULL, deactivated_at = NULL, delete_at = NULL, delete_at_readable = NULL WHERE item_type = ? AND item_id = ?",
+                (item_type, str(item_id))
+            )
             logging.info(f"  * Reset counter for {item_type} {item_id} (found in Keycloak again)")
             self.save()
             return True
         return False
     
     def getItemsToDelete(self, item_type: str) -> list:
-        if item_type not in self.data:
+        if item_type not in self.itemTypes:
             return []
+
+        rows = self._connection.execute(
+            "SELECT item_id FROM tracker WHERE item_type = ? AND deactivated = 1 AND delete_at <= ?",
+            (item_type, time.time())
+        ).fetchall()
         
-        items_to_delete = []
-        current_time = time.time()
-        
-        for item_id, info in self.data[item_type].items():
-            if info.get("deactivated", False) and "delete_at" in info:
-                if info["delete_at"] <= current_time:
-                    items_to_delete.append(item_id)
-        
-        return items_to_delete
+        return [row["item_id"] for row in rows]
     
+    def getCounts(self) -> dict:
+        """Return the number of tracked and deactivated items per item type"""
+        counts = {item_type: {"marked": 0, "deactivated": 0} for item_type in self.itemTypes}
+        rows = self._connection.execute(
+            "SELECT item_type, deactivated, COUNT(*) AS count FROM tracker GROUP BY item_type, deactivated"
+        ).fetchall()
+
+        for row in rows:
+            if row["item_type"] in counts:
+                counts[row["item_type"]]["deactivated" if row["deactivated"] else "marked"] += row["count"]
+
+        return counts
+
     def removeDeleted(self, item_type: str, item_id: str):
-        if item_type in self.data and item_id in self.data[item_type]:
-            del self.data[item_type][item_id]
-            self.save()
+        if item_type in self.itemTypes:
+            cursor = self._connection.execute(
+                "DELETE FROM tracker WHERE item_type = ? AND item_id = ?",
+                (item_type, str(item_id))
+            )
+            if cursor.rowcount > 0:
+                self.save()
     
     def isMarkedForDeactivation(self, item_type: str, item_id: str) -> bool:
-        if item_type in self.data and item_id in self.data[item_type]:
-            return self.data[item_type][item_id].get("deactivated", False)
+        info = self._getItem(item_type, item_id)
+        if info is not None:
+            return info.get("deactivated", False)
         return False
     
     def getMarkCount(self, item_type: str, item_id: str) -> int:
-        if item_type in self.data and item_id in self.data[item_type]:
-            return self.data[item_type][item_id].get("mark_count", 0)
+        info = self._getItem(item_type, item_id)
+        if info is not None:
+            return info.get("mark_count", 0)
         return 0
     
     def getDeactivationInfo(self, item_type: str, item_id: str) -> dict:
         if self.isMarkedForDeactivation(item_type, item_id):
-            return self.data[item_type][item_id]
+            return self._getItem(item_type, item_id)
         return None
     
     def formatDescriptionWithDeletionDate(self, original_description: str, item_type: str, item_id: str) -> str:
@@ -168,8 +288,7 @@ class DeactivationTracker:
         for member in members_still_present:
             member_key = f"{alias_address}:{member}"
             try:
-                if "alias_members" in self.data and member_key in self.data["alias_members"]:
-                    self.reactivate("alias_members", member_key)
+                self.reactivate("alias_members", member_key)
             except Exception as e:
                 logging.error(f"    -> Error reactivating member {member}: {e}")
 
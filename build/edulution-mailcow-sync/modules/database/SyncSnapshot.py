@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import logging
+import sqlite3
+
+class SyncSnapshot:
+    """
+    Persisted state of the last successful sync cycle, used by the incremental sync mode.
+
+    It stores a content hash of every desired object, the mailcow collections downloaded
+    during the last full reconcile and the object counts per domain reported by mailcow.
+    """
+
+    ignoredKeys = ["password", "password2"]  # Randomly generated on every cycle
+    collectionNames = ["mailboxes", "aliases", "filters"]
+
+    def __init__(self, storage_path="/srv/docker/edulution-mail/data"):
+        self.storage_path = storage_path
+        self.storage_file = os.path.join(storage_path, "sync_snapshot.db")
+        self._connection = None
+        self._hashes = {}
+        self._currentHashes = {}
+        self.load()
+
+    def load(self):
+        try:
+            os.makedirs(self.storage_path, exist_ok=True)
+            self._connection = sqlite3.connect(self.storage_file)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS object_hashes (object_type TEXT NOT NULL, object_id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (object_type, object_id))")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection.commit()
+
+            for object_type, object_id, value in self._connection.execute("SELECT object_type, object_id, hash FROM object_hashes"):
+                self._hashes[(object_type, object_id)] = value
+
+            logging.info(f"  * Loaded sync snapshot from {self.storage_file} ({len(self._hashes)} objects)")
+        except Exception as e:
+            logging.error(f"  * Failed to load sync snapshot: {e}")
+            raise
+
+    def _getMeta(self, key: str, default=None):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def _setMeta(self, key: str, value):
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _getDomainCounts(self, domains: list) -> dict:
+        counts = {}
+        for domain in domains:
+            counts[domain.get("domain_name")] = [domain.get("mboxes_in_domain"), domain.get("aliases_in_domain")]
+        return counts
+
+    def beginCycle(self):
+        self._currentHashes = {}
+
+    def checkFullSyncRequired(self, domains: list, full_sync_every: int) -> str | None:
+        """Return the reason why a full reconcile is required, or None if an incremental cycle is possible"""
+        if self._connection.execute("SELECT COUNT(*) FROM collections").fetchone()[0] < len(self.collectionNames):
+            return "no snapshot of the mailcow state available"
+
+        if self._getMeta("dirty", True):
+            return "the last cycle wrote changes to mailcow"
+
+        if self._getMeta("cycles_since_full", 0) + 1 >= full_sync_every:
+            return f"periodic full reconcile (every {full_sync_every} cycles)"
+
+        if self._getMeta("domain_counts", {}) != self._getDomainCounts(domains):
+            return "mailcow object counts changed outside of the sync"
+
+        return None
+
+    def getCollections(self) -> dict:
+        collections = {}
+        for name, data in self._connection.execute("SELECT name, data FROM collections"):
+            collections[name] = json.loads(data)
+        return collections
+
+    def hasChanged(self, object_type: str, object_id: str, element: dict) -> bool:
+        """Record the hash of the desired object and return if it differs from the last successful cycle"""
+        content = {key: value for key, value in element.items() if key not in self.ignoredKeys}
+        value = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+        key = (object_type, str(object_id))
+        self._currentHashes[key] = value
+        return self._hashes.get(key) != value
+
+    def forget(self, object_type: str, object_id: str):
+        """Don't remember the object, so it is processed again in the next cycle"""
+        self._currentHashes.pop((object_type, str(object_id)), None)
+
+    def markDirty(self):
+        """Persist that mailcow may be changed, so a crash forces a full reconcile"""
+        self._setMeta("dirty", True)
+        self._connection.commit()
+
+    def commitCycle(self, full_sync: bool, domains: list, collections: dict | None, wrote_changes: bool):
+        """Store the state of a successful cycle in one transaction"""
+        with self._connection:
+            self._connection.execute("DELETE FROM object_hashes")
+            self._connection.executemany(
+                "INSERT INTO object_hashes (object_type, object_id, hash) VALUES (?, ?, ?)",
+                [(object_type, object_id, value) for (object_type, object_id), value in self._currentHashes.items()]
+            )
+
+            if full_sync:
+                for name in self.collectionNames:
+                    self._connection.execute("INSERT OR REPLACE INTO collections (name, data) VALUES (?, ?)", (name, json.dumps(collections.get(name) or [])))
+                self._setMeta("domain_counts", self._getDomainCounts(domains))
+                self._setMeta("cycles_since_full", 0)
+            else:
+                self._setMeta("cycles_since_full", self._getMeta("cycles_since_full", 0) + 1)
+
+            self._setMeta("dirty", wrote_changes)
+
+        self._hashes = self._currentHashes
+        self._currentHashes = {}
@@ -1,3 +1,4 @@
 from .DeactivationTracker import DeactivationTracker
+from .SyncSnapshot import SyncSnapshot
 
-__all__ = ["DeactivationTracker"]
\ No newline at end of file
+__all__ = ["DeactivationTracker", "SyncSnapshot"]
\ No newline at end of file
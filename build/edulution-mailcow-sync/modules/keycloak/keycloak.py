@@ -1,20 +1,33 @@
+import hashlib
+import hmac
 import logging
+import os
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
+from jwcrypto import jwk
 from keycloak import KeycloakAdmin, KeycloakOpenID
 
+from ..cache import TTLCache
+
 import urllib3
 urllib3.disable_warnings()
 
 class Keycloak:
 
-    def __init__(self, server_url: str, client_id: str, client_secret_key: str):
+    def __init__(self, server_url: str, client_id: str, client_secret_key: str, concurrency: int = 4):
         self.server_url = server_url
         self.client_id = client_id
         self.client_secret_key = client_secret_key
         self.page_size = 50  # Number of users per page
+        self.concurrency = max(1, int(concurrency))  # Number of groups fetched in parallel
+        self.request_count = 0  # Number of admin API requests since last reset
+        self._request_count_lock = threading.Lock()
+        self.metrics = None  # Optional SyncMetrics, records count and latency of every admin request
 
-    def initKeycloakOpenID(self) -> None:
+    def initKeycloakOpenID(self, cache_ttl: int = 300, cache_size: int = 10000, jwks_ttl: int = 3600) -> None:
         self.keycloak_openid = KeycloakOpenID(
             server_url=self.server_url,
             client_id=self.client_id,
@@ -23,6 +36,18 @@ class Keycloak:
             verify=False
         )
 
+        # Successful logins and decoded tokens, keyed by a salted hash so no secret is kept in memory
+        self.auth_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.token_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._cache_salt = os.urandom(32)
+
+        # Signing keys of the realm, so tokens are verified locally
+        self.jwks_ttl = jwks_ttl
+        self.jwks_min_refresh = 30  # Invalid tokens must not make us download the keys on every request
+        self._jwks = None
+        self._jwks_fetched_at = 0
+        self._jwks_lock = threading.Lock()
+
     def initKeycloakAdmin(self) -> None:
         self.keycloak_admin = KeycloakAdmin(
             server_url=self.server_url,
@@ -32,27 +57,85 @@ class Keycloak:
             verify=False
         )
 
+    def _adminRequest(self, method: str, *args, **kwargs):
+        """Call a KeycloakAdmin method and count it as one request"""
+        with self._request_count_lock:
+            self.request_count += 1
+
+        start = time.perf_counter()
+        success = False
+        try:
+            result = getattr(self.keycloak_admin, method)(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            if self.metrics is not None:
+                self.metrics.observeRequest("keycloak", method, time.perf_counter() - start, success)
+
+    def resetRequestCount(self) -> None:
+        self.request_count = 0
+
+    def _cacheKey(self, *values: str) -> str:
+        return hmac.new(self._cache_salt, "\0".join(values).encode(), hashlib.sha256).hexdigest()
+
+    def _getSigningKeys(self, refresh: bool = False) -> jwk.JWKSet:
+        with self._jwks_lock:
+            age = time.time() - self._jwks_fetched_at
+            if self._jwks is None or age >= self.jwks_ttl or (refresh and age >= self.jwks_min_refresh):
+                keys = jwk.JWKSet()
+                for cert in self.keycloak_openid.certs().get("keys", []):
+                    keys.add(jwk.JWK(**cert))
+                self._jwks = keys
+                self._jwks_fetched_at = time.time()
+            return self._jwks
+
     def authenticate(self, username: str, password: str) -> bool:
+        cacheKey = self._cacheKey(username, password)
+        if self.auth_cache.get(cacheKey):
+            return True
+
         try:
             token = self.keycloak_openid.token(username, password)
             if "access_token" in token:
+                self.auth_cache.set(cacheKey, True)
                 return True
             return False
         except:
             return False
         
     def checkToken(self, token: str) -> str | bool:
+        cacheKey = self._cacheKey(token)
+        email = self.token_cache.get(cacheKey)
+        if email is not None:
+            return email
+
         try:
-            result = self.keycloak_openid.decode_token(token)
-            return str(result.get("email"))
+            try:
+                result = self.keycloak_openid.decode_token(token, key=self._getSigningKeys())
+            except:
+                # The realm keys may have been rotated, retry once with fresh keys
+                result = self.keycloak_openid.decode_token(token, key=self._getSigningKeys(refresh=True))
+
+            email = str(result.get("email"))
+            expiresIn = result.get("exp", 0) - time.time()
+            if expiresIn > 0:
+                self.token_cache.set(cacheKey, email, ttl=min(expiresIn, self.token_cache.ttl))
+            return email
         except:
             return False
 
+    def getCacheStats(self) -> dict:
+        return {
+            "authenticate": self.auth_cache.stats(),
+            "token": self.token_cache.stats(),
+            "jwks_age": int(time.time() - self._jwks_fetched_at) if self._jwks is not None else None
+        }
+
     def getUsers(self) -> list:
         """Get all users with pagination and retry logic"""
         logging.info("  * Downloading list of users from keycloak...")
 
-        users_count = self.keycloak_admin.users_count()
+        users_count = self._adminRequest("users_count")
         logging.info(f"    -> Total users in Keycloak: {users_count}")
 
         result = []
@@ -67,7 +150,7 @@ class Keycloak:
                 try:
                     # Get users with pagination parameters
                     # first: starting position, max: number of users to retrieve
-                    users_batch = self.keycloak_admin.get_users({
+                    users_batch = self._adminRequest("get_users", {
                         "first": first,
                         "max": self.page_size
                     })
@@ -116,69 +199,99 @@ class Keycloak:
         return result
     
     def getGroups(self) -> list:
-        """Get all groups with pagination and retry logic"""
-        logging.info("  * Downloading list of groups from keycloak...")
-        result = []
+        """Get all groups with pagination and retry logic, details and members are fetched in parallel"""
+        logging.info(f"  * Downloading list of groups from keycloak (concurrency: {self.concurrency})...")
+        futures = []
         first = 0  # Starting position
         max_retries = 6
-        
-        while True:
-            groups_batch = None
-            
-            # Retry logic for each batch
-            for attempt in range(max_retries):
-                try:
-                    # Get groups with pagination parameters
-                    groups_batch = self.keycloak_admin.get_groups({
-                        "first": first,
-                        "max": self.page_size
-                    })
-                    
-                    if groups_batch is not None:
-                        break
-                        
-                except Exception as e:
-                    logging.warning(f"    -> Failed to get groups batch starting at {first} (attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        logging.warning(f"    -> Waiting {(attempt + 1) * 10} seconds before retrying...")
-                        time.sleep((attempt + 1) * 10)
-                    else:
-                        logging.error(f"    -> Failed to retrieve groups batch after {max_retries} attempts")
-                        raise
-            
-            # Process the batch
-            if groups_batch:
-                # Check if we got a valid list response
-                if not isinstance(groups_batch, list):
-                    logging.error(f"    -> Unexpected response type from Keycloak: {type(groups_batch)} - {groups_batch}")
-                    raise Exception(f"Keycloak returned invalid data type: {type(groups_batch)}")
-                
-                for group in groups_batch:
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                groups_batch = None
+
+                # Retry logic for each batch
+                for attempt in range(max_retries):
                     try:
-                        group_details = self.keycloak_admin.get_group(group["id"])
-                        if "attributes" in group_details and "mail" in group_details["attributes"] and "sophomorixMaillist" in group_details["attributes"]:
-                            if group_details["attributes"]["sophomorixMaillist"][0] == "TRUE":
-                                group_details["members"] = self.getGroupMembers(group_details)
-                                result.append(group_details)
+                        # Get groups with pagination parameters
+                        groups_batch = self._adminRequest("get_groups", {
+                            "first": first,
+                            "max": self.page_size
+                        })
+
+                        if groups_batch is not None:
+                            break
+
                     except Exception as e:
-                        logging.warning(f"    -> Failed to get details for group {group.get('name', 'unknown')}: {e}")
-                        raise
-                
-                logging.debug(f"    -> Retrieved batch: {len(groups_batch)} groups (mailing lists found: {len(result)})")
-                
-                # Check if we got fewer groups than requested (indicates last page)
-                if len(groups_batch) < self.page_size:
+                        logging.warning(f"    -> Failed to get groups batch starting at {first} (attempt {attempt + 1}/{max_retries}): {e}")
+                        if attempt < max_retries - 1:
+                            logging.warning(f"    -> Waiting {(attempt + 1) * 10} seconds before retrying...")
+                            time.sleep((attempt + 1) * 10)
+                        else:
+                            logging.error(f"    -> Failed to retrieve groups batch after {max_retries} attempts")
+                            raise
+
+                # Process the batch
+                if groups_batch:
+                    # Check if we got a valid list response
+                    if not isinstance(groups_batch, list):
+                        logging.error(f"    -> Unexpected response type from Keycloak: {type(groups_batch)} - {groups_batch}")
+                        raise Exception(f"Keycloak returned invalid data type: {type(groups_batch)}")
+
+                    # Queue details and members of each group, the next page is requested meanwhile
+                    for group in groups_batch:
+                        futures.append(executor.submit(self._getMailingListGroup, group))
+
+                    logging.debug(f"    -> Retrieved batch: {len(groups_batch)} groups (queued so far: {len(futures)})")
+
+                    # Check if we got fewer groups than requested (indicates last page)
+                    if len(groups_batch) < self.page_size:
+                        break
+
+                    # Move to next page
+                    first += self.page_size
+                else:
+                    # No more groups
                     break
-                    
-                # Move to next page
-                first += self.page_size
-            else:
-                # No more groups
-                break
-        
+
+            # Collect in page order, so the result does not depend on the concurrency
+            result = []
+            try:
+                for future in futures:
+                    group_details = future.result()
+                    if group_details is not None:
+                        result.append(group_details)
+            except Exception:
+                # One group failed after all retries, don't wait for the remaining ones
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
         logging.info(f"    -> Successfully retrieved {len(result)} groups")
         return result
-    
+
+    def _getMailingListGroup(self, group: dict) -> dict | None:
+        """Get details and members of a group with retry logic, returns None if the group is no mailing list"""
+        max_retries = 6
+
+        for attempt in range(max_retries):
+            try:
+                group_details = self._adminRequest("get_group", group["id"])
+                break
+            except Exception as e:
+                logging.warning(f"    -> Failed to get details for group {group.get('name', 'unknown')} (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    logging.warning(f"    -> Waiting {(attempt + 1) * 10} seconds before retrying...")
+                    time.sleep((attempt + 1) * 10)
+                else:
+                    logging.error(f"    -> Failed to get details for group {group.get('name', 'unknown')} after {max_retries} attempts")
+                    raise
+
+        if "attributes" in group_details and "mail" in group_details["attributes"] and "sophomorixMaillist" in group_details["attributes"]:
+            if group_details["attributes"]["sophomorixMaillist"][0] == "TRUE":
+                group_details["members"] = self.getGroupMembers(group_details)
+                return group_details
+
+        return None
+
     def getGroupMembers(self, group: dict) -> list:
         """Get group members with pagination and retry logic"""
         logging.info(f"    -> Loading members for group {group['name']}")
@@ -192,7 +305,7 @@ class Keycloak:
             for attempt in range(max_retries):
                 try:
                     # Get members with pagination
-                    members_batch = self.keycloak_admin.get_group_members(
+                    members_batch = self._adminRequest("get_group_members",
                         group_id=group['id'],
                         query={
                             "first": first,
@@ -231,9 +344,61 @@ class Keycloak:
         logging.debug(f"       -> Retrieved {len(members)} members for group {group['name']}")
         return members
     
+    def getGroupMembershipIndex(self, validGroups: list) -> set:
+        """Get the IDs of all direct members of the given groups, to answer membership checks from memory"""
+        logging.info("  * Building group membership index from keycloak...")
+        index = set()
+
+        for groupName in validGroups:
+            if not groupName:
+                continue
+
+            groups = self._findGroupsByName(groupName)
+            if not groups:
+                logging.warning(f"    -> Group {groupName} not found in Keycloak, skipping!")
+                continue
+
+            for group in groups:
+                for member in self.getGroupMembers(group):
+                    if "id" in member:
+                        index.add(member["id"])
+
+        logging.info(f"    -> {len(index)} users are member of {', '.join(validGroups)}")
+        return index
+
+    def _findGroupsByName(self, groupName: str) -> list:
+        """Search a group by name, including subgroups, with retry logic"""
+        max_retries = 6
+        groups = None
+
+        for attempt in range(max_retries):
+            try:
+                groups = self._adminRequest("get_groups", {"search": groupName})
+                if groups is not None:
+                    break
+            except Exception as e:
+                logging.warning(f"    -> Failed to search group {groupName} (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    logging.warning(f"    -> Waiting {(attempt + 1) * 10} seconds before retrying...")
+                    time.sleep((attempt + 1) * 10)
+                else:
+                    logging.error(f"    -> Failed to search group {groupName} after {max_retries} attempts")
+                    raise
+
+        # The search also returns parents of matching subgroups, so walk the whole tree
+        result = []
+        pending = list(groups or [])
+        while pending:
+            group = pending.pop()
+            if group.get("name") == groupName:
+                result.append(group)
+            pending.extend(group.get("subGroups", []))
+
+        return result
+
     def checkGroupMembershipForUser(self, userid: str, validGroups: list) -> bool:
         try:
-            groups = self.keycloak_admin.get_user_groups(userid)
+            groups = self._adminRequest("get_user_groups", userid)
             for group in groups:
                 if group["name"] in validGroups:
                     return True
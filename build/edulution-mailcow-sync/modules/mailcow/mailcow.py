@@ -1,19 +1,46 @@
 import requests
 import logging
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 class Mailcow:
 
-    def __init__(self, apiToken: str):
-        self._url = "nginx"
+    batchSize = 100  # Maximum number of items in one multi-item request
+
+    def __init__(self, apiToken: str, concurrency: int = 4, baseUrl: str = "https://nginx"):
+        self._baseUrl = baseUrl
         self._apiToken = apiToken
+        self._concurrency = max(1, int(concurrency))  # Number of independent write requests in flight
+        self.write_count = 0  # Number of write requests since last reset
+        self._write_count_lock = threading.Lock()
+        self.metrics = None  # Optional SyncMetrics, records count and latency of every request
 
         requests.packages.urllib3.util.connection.HAS_IPV6 = False
 
-    def _getRequest(self, url: str) -> dict:
-        requestUrl = "https://" + self._url + "/" + url
-        headers = {'X-API-Key': self._apiToken, 'Content-type': 'application/json'}
+        # One keep-alive session for all requests instead of a new TLS connection per call
+        self._session = requests.Session()
+        self._session.headers.update({'X-API-Key': self._apiToken, 'Content-type': 'application/json'})
+        self._session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._concurrency)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
 
-        req = requests.get(requestUrl, headers=headers, verify=False)
+    def _timedRequest(self, method: str, url: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        req = None
+        try:
+            req = self._session.request(method, self._baseUrl + "/" + url, **kwargs)
+            return req
+        finally:
+            if self.metrics is not None:
+                self.metrics.observeRequest("mailcow", url, time.perf_counter() - start, req is not None and req.status_code == 200)
+
+    def _getRequest(self, url: str) -> dict:
+        req = self._timedRequest("GET", url)
         if req.status_code != 200:
             logging.error("  * ERROR! Could not connect to mailcow api!")
             logging.error("  * " + req.text)
@@ -21,19 +48,28 @@ class Mailcow:
         
         return req.json()
     
-    def _postRequest(self, url: str, data: dict) -> dict:
-        requestUrl = "https://" + self._url + "/" + url
-        headers = {'X-API-Key': self._apiToken, 'Content-type': 'application/json'}
+    def _postRequestResults(self, url: str, data: dict | list) -> list | bool:
+        with self._write_count_lock:
+            self.write_count += 1
 
-        req = requests.post(requestUrl, json=data, headers=headers, verify=False)
+        req = self._timedRequest("POST", url, json=data)
         if req.status_code != 200:
             logging.error("  * ERROR! Could not connect to mailcow api!")
             logging.error("  * " + req.text)
             return False
-        
+
         res = req.json()
-        if isinstance(res, list):
-            res = res[0]
+        if not isinstance(res, list):
+            res = [res]
+
+        return res
+
+    def _postRequest(self, url: str, data: dict | list) -> dict:
+        res = self._postRequestResults(url, data)
+        if res is False:
+            return False
+
+        res = res[0]
         
         if res["type"] != "success":
             logging.error("  * ERROR! API Request failed!")
@@ -41,6 +77,90 @@ class Mailcow:
             return False
 
         return True
+
+    def resetWriteCount(self) -> None:
+        self.write_count = 0
+
+    def _postBatchRequest(self, url: str, data: dict | list, itemIds: list, singleFunction) -> dict:
+        """Send a multi-item request and return the success per item, items mailcow doesn't name are retried with singleFunction"""
+        res = self._postRequestResults(url, data)
+        if res is False:
+            return {itemId: False for itemId in itemIds}
+
+        failed = [result for result in res if result.get("type") != "success"]
+        if not failed:
+            return {itemId: True for itemId in itemIds}
+
+        # Mailcow names the affected item in the message list, use it to assign every result to its item
+        itemResults = {}
+        for result in res:
+            message = result.get("msg")
+            elements = [str(element) for element in message] if isinstance(message, list) else [str(message)]
+            success = result.get("type") == "success"
+            if not success:
+                logging.error("  * ERROR! API Request failed!")
+                logging.error("  * Message: " + str(message))
+            for itemId in itemIds:
+                if str(itemId) in elements and itemResults.get(itemId, True):
+                    itemResults[itemId] = success
+
+        unresolved = [itemId for itemId in itemIds if itemId not in itemResults]
+        if unresolved:
+            logging.info(f"    -> Retrying {len(unresolved)} item(s) one by one: {', '.join(str(x) for x in unresolved)}")
+            for itemId in unresolved:
+                itemResults[itemId] = singleFunction(itemId)
+
+        return {itemId: itemResults[itemId] for itemId in itemIds}
+
+    def _runConcurrently(self, function, elements: list) -> list:
+        """Run independent requests with at most self._concurrency in flight, results keep the input order"""
+        if self._concurrency == 1 or len(elements) <= 1:
+            return [function(element) for element in elements]
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            return list(executor.map(function, elements))
+
+    def _chunk(self, elements: list) -> list:
+        return [elements[i:i + self.batchSize] for i in range(0, len(elements), self.batchSize)]
+
+    def _mergeUpdates(self, updates: list) -> list:
+        """Merge updates with identical attr payloads into multi-item updates"""
+        merged = {}
+        for update in updates:
+            key = json.dumps(update["attr"], sort_keys=True)
+            if key not in merged:
+                merged[key] = {"attr": update["attr"], "items": []}
+            merged[key]["items"].extend(update["items"])
+
+        result = []
+        for update in merged.values():
+            for items in self._chunk(update["items"]):
+                result.append({"attr": update["attr"], "items": items})
+        return result
+
+    def _updateMany(self, updates: list, singleFunction, requestQuery: str, descriptor: str) -> dict:
+        def run(update: dict) -> dict:
+            if len(update["items"]) == 1:
+                return {update["items"][0]: singleFunction(update)}
+            logging.info(f"  * Edit {len(update['items'])} {descriptor} on mailcow: {', '.join(str(x) for x in update['items'])}")
+            return self._postBatchRequest(requestQuery, update, update["items"], lambda itemId: singleFunction({"attr": update["attr"], "items": [itemId]}))
+
+        results = {}
+        for batchResult in self._runConcurrently(run, self._mergeUpdates(updates)):
+            results.update(batchResult)
+        return results
+
+    def _deleteMany(self, itemIds: list, singleFunction, requestQuery: str, descriptor: str) -> dict:
+        def run(chunk: list) -> dict:
+            if len(chunk) == 1:
+                return {chunk[0]: singleFunction(chunk[0])}
+            logging.info(f"  * Deleting {len(chunk)} {descriptor} from mailcow...")
+            return self._postBatchRequest(requestQuery, chunk, chunk, singleFunction)
+
+        results = {}
+        for batchResult in self._runConcurrently(run, self._chunk(list(itemIds))):
+            results.update(batchResult)
+        return results
     
     # ========================================================================================
 
@@ -58,6 +178,19 @@ class Mailcow:
         logging.info(f"  * Edit domain {domain['attr']['domain']} on mailcow...")
         requestQuery = "/api/v1/edit/domain"
         return self._postRequest(requestQuery, domain)
+
+    def addDomains(self, domains: list) -> list:
+        return self._runConcurrently(self.addDomain, domains)
+
+    def updateDomains(self, domains: list) -> dict:
+        return self._updateMany(domains, self.updateDomain, "/api/v1/edit/domain", "domain(s)")
+
+    def deactivateDomains(self, domains: list) -> dict:
+        return self._updateMany([{"attr": {"active": 0}, "items": [domain]} for domain in domains], self._deactivateDomain, "/api/v1/edit/domain", "domain(s)")
+
+    def _deactivateDomain(self, domain: dict) -> bool:
+        logging.info(f"  * Deactivate domain {domain['items'][0]} on mailcow...")
+        return self._postRequest("/api/v1/edit/domain", domain)
     
     # ========================================================================================
 
@@ -75,6 +208,19 @@ class Mailcow:
         logging.info(f"  * Edit mailbox {mailbox['attr']['local_part']}@{mailbox['attr']['domain']} on mailcow...")
         requestQuery = "/api/v1/edit/mailbox"
         return self._postRequest(requestQuery, mailbox)
+
+    def addMailboxes(self, mailboxes: list) -> list:
+        return self._runConcurrently(self.addMailbox, mailboxes)
+
+    def updateMailboxes(self, mailboxes: list) -> dict:
+        return self._updateMany(mailboxes, self.updateMailbox, "/api/v1/edit/mailbox", "mailbox(es)")
+
+    def deactivateMailboxes(self, mailboxes: list) -> dict:
+        return self._updateMany([{"attr": {"active": 0}, "items": [mailbox]} for mailbox in mailboxes], self._deactivateMailbox, "/api/v1/edit/mailbox", "mailbox(es)")
+
+    def _deactivateMailbox(self, mailbox: dict) -> bool:
+        logging.info(f"  * Deactivate mailbox {mailbox['items'][0]} on mailcow...")
+        return self._postRequest("/api/v1/edit/mailbox", mailbox)
     
     # ========================================================================================
 
@@ -92,6 +238,12 @@ class Mailcow:
         logging.info(f"  * Edit alias {alias['attr']['address']} on mailcow...")
         requestQuery = "/api/v1/edit/alias"
         return self._postRequest(requestQuery, alias)
+
+    def addAliases(self, aliases: list) -> list:
+        return self._runConcurrently(self.addAlias, aliases)
+
+    def updateAliases(self, aliases: list) -> dict:
+        return self._updateMany(aliases, self.updateAlias, "/api/v1/edit/alias", "alias(es)")
     
     # ========================================================================================
 
@@ -109,6 +261,12 @@ class Mailcow:
         logging.info(f"  * Edit filters {filter['attr']['username']} on mailcow...")
         requestQuery = "/api/v1/edit/filter"
         return self._postRequest(requestQuery, filter)
+
+    def addFilters(self, filters: list) -> list:
+        return self._runConcurrently(self.addFilter, filters)
+
+    def updateFilters(self, filters: list) -> dict:
+        return self._updateMany(filters, self.updateFilter, "/api/v1/edit/filter", "filter(s)")
     
     # ========================================================================================
     # Delete functions for cleanup
@@ -131,4 +289,16 @@ class Mailcow:
     def deleteFilter(self, filter_id: str) -> bool:
         logging.info(f"  * Deleting filter {filter_id} from mailcow...")
         requestQuery = "/api/v1/delete/filter"
-        return self._postRequest(requestQuery, [filter_id])
\ No newline at end of file
+        return self._postRequest(requestQuery, [filter_id])
+
+    def deleteDomains(self, domains: list) -> dict:
+        return self._deleteMany(domains, self.deleteDomain, "/api/v1/delete/domain", "domain(s)")
+
+    def deleteMailboxes(self, mailboxes: list) -> dict:
+        return self._deleteMany(mailboxes, self.deleteMailbox, "/api/v1/delete/mailbox", "mailbox(es)")
+
+    def deleteAliases(self, alias_ids: list) -> dict:
+        return self._deleteMany(alias_ids, self.deleteAlias, "/api/v1/delete/alias", "alias(es)")
+
+    def deleteFilters(self, filter_ids: list) -> dict:
+        return self._deleteMany(filter_ids, self.deleteFilter, "/api/v1/delete/filter", "filter(s)")
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class SyncMetrics:
+    """
+    Timing and request metrics of the sync loop in the Prometheus text format.
+
+    The metrics can be served on a local HTTP endpoint and/or written to a file for the
+    textfile collector of the node exporter.
+    """
+
+    prefix = "edulution_mailcow_sync"
+    buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]  # Seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}  # (service, endpoint, outcome) -> count
+        self._histograms = {}  # (service, endpoint) -> [bucket counts..., sum, count]
+        self._gauges = {}  # (name, labels) -> value
+        self._cycleStartedAt = time.perf_counter()
+        self._phaseStartedAt = None
+        self._phase = None
+        self._server = None
+
+    # ========================================================================================
+    # Recording
+
+    def observeRequest(self, service: str, endpoint: str, duration: float, success: bool) -> None:
+        """Count a request to keycloak or mailcow and add its duration to the latency histogram"""
+        outcome = "success" if success else "error"
+        with self._lock:
+            self._requests[(service, endpoint, outcome)] = self._requests.get((service, endpoint, outcome), 0) + 1
+
+            histogram = self._histograms.get((service, endpoint))
+            if histogram is None:
+                histogram = self._histograms[(service, endpoint)] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += duration
+            histogram[-1] += 1
+
+    def setGauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def startPhase(self, phase: str) -> None:
+        """Finish the running phase of the cycle and start the next one"""
+        self.endPhase()
+        self._phase = phase
+        self._phaseStartedAt = time.perf_counter()
+
+    def endPhase(self) -> None:
+        if self._phase is None:
+            return
+        duration = time.perf_counter() - self._phaseStartedAt
+        self.setGauge("phase_duration_seconds", duration, phase=self._phase)
+        logging.debug(f"  * Phase {self._phase} took {duration:.2f} seconds")
+        self._phase = None
+
+    def beginCycle(self) -> None:
+        # Phases skipped by this cycle must not report the durations of an earlier one
+        with self._lock:
+            self._gauges = {key: value for key, value in self._gauges.items() if key[0] != "phase_duration_seconds"}
+        self._cycleStartedAt = time.perf_counter()
+
+    def endCycle(self, success: bool) -> None:
+        self.endPhase()
+        self.setGauge("cycle_duration_seconds", time.perf_counter() - self._cycleStartedAt)
+        self.setGauge("cycle_success", 1 if success else 0)
+        self.setGauge("cycle_finished_timestamp_seconds", time.time())
+        if success:
+            self.setGauge("last_success_timestamp_seconds", time.time())
+
+    def setQueueCounts(self, objectType: str, counts: dict) -> None:
+        for queue, count in counts.items():
+            self.setGauge("queue_size", count, type=objectType, queue=queue)
+
+    def getPhaseDurations(self) -> dict:
+        with self._lock:
+            return {dict(labels)["phase"]: value for (name, labels), value in self._gauges.items() if name == "phase_duration_seconds"}
+
+    def getRequestCounts(self) -> dict:
+        """Return the number of requests per (service, endpoint)"""
+        with self._lock:
+            counts = {}
+            for (service, endpoint, _), count in self._requests.items():
+                counts[(service, endpoint)] = counts.get((service, endpoint), 0) + count
+            return counts
+
+    # ========================================================================================
+    # Export
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {self.prefix}_api_requests_total Requests sent to keycloak and mailcow")
+            lines.append(f"# TYPE {self.prefix}_api_requests_total counter")
+            for (service, endpoint, outcome), count in sorted(self._requests.items()):
+                lines.append(f"{self.prefix}_api_requests_total{self._labels(service=service, endpoint=endpoint, outcome=outcome)} {count}")
+
+            lines.append(f"# HELP {self.prefix}_api_request_duration_seconds Latency of requests to keycloak and mailcow")
+            lines.append(f"# TYPE {self.prefix}_api_request_duration_seconds histogram")
+            for (service, endpoint), histogram in sorted(self._histograms.items()):
+                for i, bound in enumerate(self.buckets):
+                    lines.append(f"{self.prefix}_api_request_duration_seconds_bucket{self._labels(service=service, endpoint=endpoint, le=str(bound))} {histogram[i]}")
+                lines.append(f"{self.prefix}_api_request_duration_seconds_bucket{self._labels(service=service, endpoint=endpoint, le='+Inf')} {histogram[-1]}")
+                lines.append(f"{self.prefix}_api_request_duration_seconds_sum{self._labels(service=service, endpoint=endpoint)} {histogram[-2]}")
+                lines.append(f"{self.prefix}_api_request_duration_seconds_count{self._labels(service=service, endpoint=endpoint)} {histogram[-1]}")
+
+            lastName = None
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name != lastName:
+                    lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                    lastName = name
+                lines.append(f"{self.prefix}_{name}{self._labels(**dict(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, **labels) -> str:
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    def writeTextfile(self, path: str) -> None:
+        """Write the metrics atomically, so the textfile collector never reads a partial file"""
+        try:
+            tmpPath = path + ".tmp"
+            with open(tmpPath, "w") as f:
+                f.write(self.render())
+            os.replace(tmpPath, path)
+        except Exception as e:
+            logging.error(f"  * Failed to write metrics to {path}: {e}")
+
+    def startHttpServer(self, port: int, host: str = "127.0.0.1") -> None:
+        """Serve the metrics on http://host:port/metrics in a background thread"""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"* Serving sync metrics on http://{host}:{port}/metrics")
@@ -0,0 +1,3 @@
+from .SyncMetrics import SyncMetrics
+
+__all__ = ["SyncMetrics"]
@@ -19,6 +19,9 @@ class ConfigurationStorage:
 
         self.SYNC_INTERVAL = os.environ.get("SYNC_INTERVAL", 300)
         self.RETRY_INTERVAL = int(self.SYNC_INTERVAL) // 5 if int(self.SYNC_INTERVAL) >= 60 else 10
+
+        self.INCREMENTAL_SYNC = int(os.environ.get("INCREMENTAL_SYNC", 0))  # Only process objects changed since the last sync
+        self.FULL_SYNC_EVERY = int(os.environ.get("FULL_SYNC_EVERY", 12))  # Number of cycles after which a full reconcile is forced
         
         self.DELETE_ENABLED = int(os.environ.get("DELETE_ENABLED", 0))  # Master switch for deletion (default: disabled)
         self.SOFT_DELETE_ENABLED = int(os.environ.get("SOFT_DELETE_ENABLED", 1))
@@ -33,8 +36,17 @@ class ConfigurationStorage:
         self.KEYCLOAK_CLIENT_ID = os.environ.get("KEYCLOAK_CLIENT_ID", "edu-mailcow-sync")
         self.KEYCLOAK_SECRET_KEY = os.environ.get("KEYCLOAK_SECRET_KEY", False)
         self.KEYCLOAK_SERVER_URL = os.environ.get("KEYCLOAK_SERVER_URL", "https://edulution-traefik/auth/")
+        self.KEYCLOAK_CONCURRENCY = int(os.environ.get("KEYCLOAK_CONCURRENCY", 4))  # Number of groups fetched from keycloak in parallel
+
+        self.AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 300))  # Seconds a successful login or token check of the api is cached (0 disables the cache)
+        self.AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))  # Maximum number of cached logins and tokens
 
         self.MAILCOW_PATH = os.environ.get("MAILCOW_PATH", "/srv/docker/edulution-mail")
+        self.MAILCOW_CONCURRENCY = int(os.environ.get("MAILCOW_CONCURRENCY", 4))  # Number of independent write requests to mailcow in flight
+
+        self.METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # Port of the prometheus metrics endpoint (0 disables it)
+        self.METRICS_ADDRESS = os.environ.get("METRICS_ADDRESS", "127.0.0.1")  # Address the metrics endpoint listens on
+        self.METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE", "")  # File for the node exporter textfile collector (empty disables it)
 
         self.IGNORE_MAILBOXES = os.environ.get("IGNORE_MAILBOXES", "")
         self.IGNORE_MAILBOXES = self.IGNORE_MAILBOXES.split(",") if "," in self.IGNORE_MAILBOXES else [ self.IGNORE_MAILBOXES ]
@@ -59,6 +71,11 @@ class ConfigurationStorage:
         - SOFT_DELETE_MARK_COUNT
         - PERMANENT_DELETE_ENABLED
         - IGNORE_MAILBOXES
+        - KEYCLOAK_CONCURRENCY
+        - MAILCOW_CONCURRENCY
+        - INCREMENTAL_SYNC
+        - FULL_SYNC_EVERY
+        - METRICS_TEXTFILE
         """
 
         OVERRIDE_FILE = os.environ.get("MAILCOW_PATH", "/srv/docker/edulution-mail") + "/mail.override.config"
@@ -122,6 +139,26 @@ class ConfigurationStorage:
                 logging.info(f"* OVERRIDE IGNORE_MAILBOXES: {self.IGNORE_MAILBOXES} with {new_ignore_mailboxes}")
                 self.IGNORE_MAILBOXES = new_ignore_mailboxes
 
+            if "KEYCLOAK_CONCURRENCY" in override_config:
+                logging.info(f"* OVERRIDE KEYCLOAK_CONCURRENCY: {self.KEYCLOAK_CONCURRENCY} with {override_config['KEYCLOAK_CONCURRENCY']}")
+                self.KEYCLOAK_CONCURRENCY = int(override_config["KEYCLOAK_CONCURRENCY"])
+
+            if "MAILCOW_CONCURRENCY" in override_config:
+                logging.info(f"* OVERRIDE MAILCOW_CONCURRENCY: {self.MAILCOW_CONCURRENCY} with {override_config['MAILCOW_CONCURRENCY']}")
+                self.MAILCOW_CONCURRENCY = int(override_config["MAILCOW_CONCURRENCY"])
+
+            if "INCREMENTAL_SYNC" in override_config:
+                logging.info(f"* OVERRIDE INCREMENTAL_SYNC: {self.INCREMENTAL_SYNC} with {override_config['INCREMENTAL_SYNC']}")
+                self.INCREMENTAL_SYNC = int(override_config["INCREMENTAL_SYNC"])
+
+            if "FULL_SYNC_EVERY" in override_config:
+                logging.info(f"* OVERRIDE FULL_SYNC_EVERY: {self.FULL_SYNC_EVERY} with {override_config['FULL_SYNC_EVERY']}")
+                self.FULL_SYNC_EVERY = int(override_config["FULL_SYNC_EVERY"])
+
+            if "METRICS_TEXTFILE" in override_config:
+                logging.info(f"* OVERRIDE METRICS_TEXTFILE: {self.METRICS_TEXTFILE} with {override_config['METRICS_TEXTFILE']}")
+                self.METRICS_TEXTFILE = override_config["METRICS_TEXTFILE"]
+
             logging.info("==========================================================")
             
 
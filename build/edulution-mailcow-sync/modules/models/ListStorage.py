@@ -47,19 +47,33 @@ class ListStorage:
 
         return True
     
+    def keepElement(self, elementId: str) -> None:
+        # Element is unchanged since the last sync, only protect it from being disabled
+        if elementId in self._disableQueue:
+            del self._disableQueue[elementId]
+
     def queuesAreEmpty(self) -> bool:
         return len(self._addQueue) == 0 and len(self._updateQueue) == 0 and len(self._disableQueue) == 0 and len(self._killQueue) == 0
 
+    def getQueueCounts(self) -> dict:
+        return {
+            "add": len(self._addQueue),
+            "update": len(self._updateQueue),
+            "disable": len(self._disableQueue),
+            "kill": len(self._killQueue)
+        }
+
     def getQueueCountsString(self, descriptor: str) -> str:
+        counts = self.getQueueCounts()
         parts = []
-        if len(self._addQueue) > 0:
-            parts.append(f"add {len(self._addQueue)}")
-        if len(self._updateQueue) > 0:
-            parts.append(f"update {len(self._updateQueue)}")
-        if len(self._disableQueue) > 0:
-            parts.append(f"disable/delete {len(self._disableQueue)}")
-        if len(self._killQueue) > 0:
-            parts.append(f"permanently delete {len(self._killQueue)}")
+        if counts["add"] > 0:
+            parts.append(f"add {counts['add']}")
+        if counts["update"] > 0:
+            parts.append(f"update {counts['update']}")
+        if counts["disable"] > 0:
+            parts.append(f"disable/delete {counts['disable']}")
+        if counts["kill"] > 0:
+            parts.append(f"permanently delete {counts['kill']}")
         
         if parts:
             return f"Going to {', '.join(parts)} {descriptor}"
@@ -6,7 +6,7 @@ import time
 import logging
 import os
 
-from modules import Keycloak, Mailcow, DomainListStorage, MailboxListStorage, ConfigurationStorage, AliasListStorage, FilterListStorage, DeactivationTracker
+from modules import Keycloak, Mailcow, ListStorage, DomainListStorage, MailboxListStorage, ConfigurationStorage, AliasListStorage, FilterListStorage, DeactivationTracker, SyncSnapshot, SyncMetrics
 
 # Configure logging level from environment variable
 # To enable debug mode, set: LOG_LEVEL=DEBUG
@@ -25,12 +25,20 @@ class EdulutionMailcowSync:
     def __init__(self):
         self._config = self._readConfig()
 
-        self.keycloak = Keycloak(server_url=self._config.KEYCLOAK_SERVER_URL, client_id=self._config.KEYCLOAK_CLIENT_ID, client_secret_key=self._config.KEYCLOAK_SECRET_KEY)
-        self.mailcow = Mailcow(apiToken=self._config.MAILCOW_API_TOKEN)
+        self.keycloak = Keycloak(server_url=self._config.KEYCLOAK_SERVER_URL, client_id=self._config.KEYCLOAK_CLIENT_ID, client_secret_key=self._config.KEYCLOAK_SECRET_KEY, concurrency=self._config.KEYCLOAK_CONCURRENCY)
+        self.mailcow = Mailcow(apiToken=self._config.MAILCOW_API_TOKEN, concurrency=self._config.MAILCOW_CONCURRENCY)
         self.deactivationTracker = DeactivationTracker(
             storage_path=self._config.MAILCOW_PATH + "/data",
             mark_count_threshold=self._config.SOFT_DELETE_MARK_COUNT
         )
+        self.syncSnapshot = SyncSnapshot(storage_path=self._config.MAILCOW_PATH + "/data") if self._config.INCREMENTAL_SYNC else None
+        self._incrementalCycle = False
+
+        self.metrics = SyncMetrics()
+        self.keycloak.metrics = self.metrics
+        self.mailcow.metrics = self.metrics
+        if self._config.METRICS_PORT:
+            self.metrics.startHttpServer(self._config.METRICS_PORT, self._config.METRICS_ADDRESS)
 
         self.keycloak.initKeycloakAdmin()
 
@@ -58,6 +66,31 @@ class EdulutionMailcowSync:
                 time.sleep(self._config.RETRY_INTERVAL)
 
     def _sync(self) -> bool:
+        self.metrics.beginCycle()
+        success = False
+        try:
+            # Tracker changes are written in one transaction, committed before the first mailcow write
+            with self.deactivationTracker.transaction():
+                success = self._runSync()
+            return success
+        finally:
+            self._publishMetrics(success)
+
+    def _publishMetrics(self, success: bool):
+        self.metrics.endCycle(success)
+
+        for item_type, counts in self.deactivationTracker.getCounts().items():
+            for state, count in counts.items():
+                self.metrics.setGauge("deactivation_tracker_items", count, type=item_type, state=state)
+
+        phases = self.metrics.getPhaseDurations()
+        if phases:
+            logging.info("  * Phase durations: " + ", ".join(f"{phase} {duration:.2f}s" for phase, duration in phases.items()))
+
+        if self._config.METRICS_TEXTFILE:
+            self.metrics.writeTextfile(self._config.METRICS_TEXTFILE)
+
+    def _runSync(self) -> bool:
         logging.info("=== Starting Edulution-Mailcow-Sync ===")
         logging.info("")
 
@@ -85,29 +118,59 @@ class EdulutionMailcowSync:
 
         logging.info("* 1. Loading data from mailcow and keycloak")
 
+        self.keycloak.resetRequestCount()
+        self.mailcow.resetWriteCount()
+
         # Load Mailcow data with retry logic
+        self.metrics.startPhase("load_mailcow")
         try:
-            domainList.loadRawData(self.mailcow.getDomains())
-            mailboxList.loadRawData(self.mailcow.getMailboxes())
-            aliasList.loadRawData(self.mailcow.getAliases())
-            filterList.loadRawData(self.mailcow.getFilters())
+            domains = self.mailcow.getDomains()
+            domainList.loadRawData(domains)
+
+            self._incrementalCycle = self._checkIncrementalCycle(domains)
+            self.metrics.setGauge("cycle_incremental", 1 if self._incrementalCycle else 0)
+            if self._incrementalCycle:
+                # Nothing was written since the last full reconcile, reuse the mailcow state of its snapshot
+                collections = self.syncSnapshot.getCollections()
+            else:
+                collections = {
+                    "mailboxes": self.mailcow.getMailboxes(),
+                    "aliases": self.mailcow.getAliases(),
+                    "filters": self.mailcow.getFilters()
+                }
+
+            mailboxList.loadRawData(collections["mailboxes"])
+            aliasList.loadRawData(collections["aliases"])
+            filterList.loadRawData(collections["filters"])
         except Exception as e:
             logging.error(f"Failed to load data from mailcow: {e}")
             return False
         
+        self.metrics.startPhase("load_keycloak_users")
         try:
             users = self.keycloak.getUsers()                    
         except Exception as e:
             logging.exception(f"Failed to load user from keycloak: {e}")
             return False  # Users are essential, fail completely
         
+        self.metrics.startPhase("load_keycloak_groups")
         try:
             groups = self.keycloak.getGroups()
         except Exception as e:
             logging.exception(f"Failed to load groups from keycloak: {e}")
             return False  # Groups are essential, fail completely
 
+        self.metrics.startPhase("load_keycloak_memberships")
+        try:
+            memberIndex = self.keycloak.getGroupMembershipIndex(self._config.GROUPS_TO_SYNC)
+        except Exception as e:
+            logging.exception(f"Failed to load group memberships from keycloak: {e}")
+            return False  # Memberships decide which users are synced, fail completely
+
+        logging.info(f"  * Keycloak requests in this cycle: {self.keycloak.request_count}")
+
         logging.info("* 2. Calculation deltas between keycloak and mailcow")
+        self.metrics.startPhase("compute_deltas")
 
         for user in users:
             if "email" not in user:
@@ -122,7 +185,7 @@ class EdulutionMailcowSync:
             
             maildomain = mail.split("@")[-1]
 
-            if self.keycloak.checkGroupMembershipForUser(user["id"], self._config.GROUPS_TO_SYNC):
+            if user["id"] in memberIndex:
                 if not self._addDomain(maildomain, domainList):
                     continue
                 
@@ -138,7 +201,7 @@ class EdulutionMailcowSync:
                 if "id" not in member:
                     logging.warning(f"    -> Member {member} without ID in group {mail}, skipping!")
                     continue
-                if self.keycloak.checkGroupMembershipForUser(member["id"], self._config.GROUPS_TO_SYNC):
+                if member["id"] in memberIndex:
                     if "email" not in member:
                         logging.error(f"    -> Member {member['id']} ({member.get('username', 'n/a')}) has not email attribute!")
                         continue
@@ -163,8 +226,14 @@ class EdulutionMailcowSync:
 
             self._addAliasesFromProxyAddresses(group, mail, aliasList)
 
+        self.metrics.setQueueCounts("domains", domainList.getQueueCounts())
+        self.metrics.setQueueCounts("mailboxes", mailboxList.getQueueCounts())
+        self.metrics.setQueueCounts("aliases", aliasList.getQueueCounts())
+        self.metrics.setQueueCounts("filters", filterList.getQueueCounts())
+
         if domainList.queuesAreEmpty() and mailboxList.queuesAreEmpty() and aliasList.queuesAreEmpty() and filterList.queuesAreEmpty():
             logging.info("  * Everything is up-to-date!")
+            self._commitSnapshot(domains, collections)
             return True
         else:
             logging.info("  * " + domainList.getQueueCountsString("domain(s)"))
@@ -174,43 +243,77 @@ class EdulutionMailcowSync:
 
         logging.info("* 3. Syncing deltas to mailcow")
 
+        if self.syncSnapshot is not None:
+            self.syncSnapshot.markDirty()
+
+        # Mailcow writes can't be rolled back, so the tracker is committed before and after each of them
+        self.deactivationTracker.commit()
+
         # 1. Process deactivations and deletions
+        self.metrics.startPhase("deactivate_and_delete")
         self._processDeactivationsAndDeletions(domainList, mailboxList, aliasList, filterList)
 
         # 2. Domain(s) add and update
+        self.metrics.startPhase("apply_changes")
 
-        for domain in domainList.addQueue():
-            self.mailcow.addDomain(domain)
-
-        for domain in domainList.updateQueue():
-            self.mailcow.updateDomain(domain)
+        self.mailcow.addDomains(domainList.addQueue())
+        self.mailcow.updateDomains(domainList.updateQueue())
 
         # 3. Mailbox(es) add and update
 
-        for mailbox in mailboxList.addQueue():
-            self.mailcow.addMailbox(mailbox)
-
-        for mailbox in mailboxList.updateQueue():
-            self.mailcow.updateMailbox(mailbox)
+        self.mailcow.addMailboxes(mailboxList.addQueue())
+        self.mailcow.updateMailboxes(mailboxList.updateQueue())
 
         # 4. Alias(es) add and update
 
-        for alias in aliasList.addQueue():
-            self.mailcow.addAlias(alias)
-
-        for alias in aliasList.updateQueue():
-            self.mailcow.updateAlias(alias)
+        self.mailcow.addAliases(aliasList.addQueue())
+        self.mailcow.updateAliases(aliasList.updateQueue())
 
         # 5. Filter(s) add and update
 
-        for filter in filterList.addQueue():
-            self.mailcow.addFilter(filter)
-
-        for filter in filterList.updateQueue():
-            self.mailcow.updateFilter(filter)
+        self.mailcow.addFilters(filterList.addQueue())
+        self.mailcow.updateFilters(filterList.updateQueue())
 
+        self._commitSnapshot(domains, collections)
         return True
     
+    def _checkIncrementalCycle(self, domains: list) -> bool:
+        if self.syncSnapshot is None:
+            return False
+
+        self.syncSnapshot.beginCycle()
+
+        if self._config.FORCE_MARKER_UPDATE:
+            reason = "FORCE_MARKER_UPDATE is enabled"
+        else:
+            reason = self.syncSnapshot.checkFullSyncRequired(domains, self._config.FULL_SYNC_EVERY)
+
+        if reason:
+            logging.info(f"  * Full reconcile: {reason}")
+            return False
+
+        logging.info("  * Incremental sync: only objects changed since the last sync are processed")
+        return True
+
+    def _commitSnapshot(self, domains: list, collections: dict):
+        if self.syncSnapshot is not None:
+            self.syncSnapshot.commitCycle(
+                full_sync=not self._incrementalCycle,
+                domains=domains,
+                collections=collections,
+                wrote_changes=self.mailcow.write_count > 0
+            )
+
+    def _skipUnchanged(self, objectType: str, objectId: str, element: dict, listStorage: ListStorage) -> bool:
+        if self.syncSnapshot is None:
+            return False
+
+        changed = self.syncSnapshot.hasChanged(objectType, objectId, element)
+        if self._incrementalCycle and not changed:
+            listStorage.keepElement(objectId)
+            return True
+        return False
+
     def _readConfig(self) -> ConfigurationStorage:
         config = ConfigurationStorage()
         config.load()
@@ -230,6 +333,11 @@ class EdulutionMailcowSync:
             "gal": self._config.ENABLE_GAL
         }, domainName)
     
+    def _isActive(self, listStorage: ListStorage, elementId: str) -> bool:
+        # Deactivating again during the grace period would be a write in every cycle and prevent incremental cycles
+        element = listStorage._all.get(elementId)
+        return element is None or str(element.get("active", 1)) != "0"
+
     def _processDeactivationsAndDeletions(self, domainList: DomainListStorage, mailboxList: MailboxListStorage, aliasList: AliasListStorage, filterList: FilterListStorage):
         grace_period = self._config.SOFT_DELETE_GRACE_PERIOD
         soft_delete_enabled = self._config.SOFT_DELETE_ENABLED
@@ -249,12 +357,15 @@ class EdulutionMailcowSync:
             filter_id = filter.get('id')
             if filter_id:
                 deletion_candidates["filters"].append(filter_id)
-                if delete_enabled:
-                    self.mailcow.deleteFilter(filter_id)
+
+        if delete_enabled:
+            for filter_id, deleted in self.mailcow.deleteFilters(deletion_candidates["filters"]).items():
+                if deleted:
                     logging.info(f"  * Deleted filter {filter_id}")
-        
+
         if soft_delete_enabled:
             # Process deactivations for aliases with mark counting
+            aliases_to_delete = []
             for alias in aliasList.disableQueue():
                 alias_id = alias.get('id') or alias.get('address')
                 # Use address for logging (more user-friendly than numeric ID)
@@ -266,11 +377,16 @@ class EdulutionMailcowSync:
                     # Mark for deactivation (will only delete after threshold marks)
                     if self.deactivationTracker.markForDeactivation("aliases", alias_id, grace_period):
                         # Threshold reached - actually delete (if DELETE_ENABLED)
-                        if delete_enabled:
-                            self.mailcow.deleteAlias(alias_id)
-                            logging.info(f"  * Deleted alias {alias_id} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+                        aliases_to_delete.append(alias_id)
+
+            if delete_enabled:
+                for alias_id, deleted in self.mailcow.deleteAliases(aliases_to_delete).items():
+                    if deleted:
+                        logging.info(f"  * Deleted alias {alias_id} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+            self.deactivationTracker.commit()
             
             # Process deactivations for mailboxes - with missing count check
+            mailboxes_to_deactivate = []
             for mailbox in mailboxList.disableQueue():
                 # Get username from mailbox data
                 username = None
@@ -288,51 +404,48 @@ class EdulutionMailcowSync:
                     deletion_candidates["mailboxes"].append(username)
                     # Mark for deactivation (will only deactivate after threshold marks)
                     if self.deactivationTracker.markForDeactivation("mailboxes", username, grace_period):
-                        # Third mark reached - actually deactivate (if DELETE_ENABLED)
-                        if delete_enabled:
-                            # Extract local_part and domain for the update
-                            local_part, domain = username.split('@')
-                            self.mailcow.updateMailbox({
-                                "attr": {
-                                    "active": 0,
-                                    "local_part": local_part,
-                                    "domain": domain
-                                },
-                                "items": [username]
-                            })
-                            logging.info(f"  * Deactivated mailbox {username} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+                        # Third mark reached - actually deactivate (if DELETE_ENABLED), unless mailcow already did
+                        if self._isActive(mailboxList, username):
+                            mailboxes_to_deactivate.append(username)
+
+            if delete_enabled:
+                for username, deactivated in self.mailcow.deactivateMailboxes(mailboxes_to_deactivate).items():
+                    if deactivated:
+                        logging.info(f"  * Deactivated mailbox {username} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+            self.deactivationTracker.commit()
             
             # Process deactivations for domains
+            domains_to_deactivate = []
             for domain in domainList.disableQueue():
                 domain_name = domain.get('domain_name')
                 if domain_name:
                     deletion_candidates["domains"].append(domain_name)
                     # Mark for deactivation (will only deactivate after threshold marks)
                     if self.deactivationTracker.markForDeactivation("domains", domain_name, grace_period):
-                        # Threshold reached - actually deactivate (if DELETE_ENABLED)
-                        if delete_enabled:
-                            self.mailcow.updateDomain({
-                                "attr": {
-                                    "active": 0,
-                                    "domain": domain_name
-                                },
-                                "items": [domain_name]
-                            })
-                            logging.info(f"  * Deactivated domain {domain_name} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+                        # Threshold reached - actually deactivate (if DELETE_ENABLED), unless mailcow already did
+                        if self._isActive(domainList, domain_name):
+                            domains_to_deactivate.append(domain_name)
+
+            if delete_enabled:
+                for domain_name, deactivated in self.mailcow.deactivateDomains(domains_to_deactivate).items():
+                    if deactivated:
+                        logging.info(f"  * Deactivated domain {domain_name} after {self._config.SOFT_DELETE_MARK_COUNT} marks")
+            self.deactivationTracker.commit()
             
             # Check for items to permanently delete (if enabled)
             if self._config.PERMANENT_DELETE_ENABLED and delete_enabled:
-                for mailbox_id in self.deactivationTracker.getItemsToDelete("mailboxes"):
-                    # Skip ignored mailboxes from permanent deletion
-                    if mailbox_id in self._config.IGNORE_MAILBOXES:
-                        continue
-                    if self.mailcow.deleteMailbox(mailbox_id):
+                # Skip ignored mailboxes from permanent deletion
+                mailbox_ids = [mailbox_id for mailbox_id in self.deactivationTracker.getItemsToDelete("mailboxes") if mailbox_id not in self._config.IGNORE_MAILBOXES]
+                for mailbox_id, deleted in self.mailcow.deleteMailboxes(mailbox_ids).items():
+                    if deleted:
                         self.deactivationTracker.removeDeleted("mailboxes", mailbox_id)
+                        self.deactivationTracker.commit()
                         logging.info(f"  * Permanently deleted mailbox {mailbox_id}")
 
-                for domain_id in self.deactivationTracker.getItemsToDelete("domains"):
-                    if self.mailcow.deleteDomain(domain_id):
+                for domain_id, deleted in self.mailcow.deleteDomains(self.deactivationTracker.getItemsToDelete("domains")).items():
+                    if deleted:
                         self.deactivationTracker.removeDeleted("domains", domain_id)
+                        self.deactivationTracker.commit()
                         logging.info(f"  * Permanently deleted domain {domain_id}")
 
                 # Also check for aliases to permanently delete
@@ -354,15 +467,19 @@ class EdulutionMailcowSync:
                     logging.info(f"  * Reactivated domain {domain_name} (found in Keycloak again)")
         else:
             # Soft delete disabled - immediate deletion (if DELETE_ENABLED)
+            alias_addresses = {}
             for alias in aliasList.disableQueue():
                 alias_id = alias.get('id') or alias.get('address')
                 # Use address for logging (more user-friendly than numeric ID)
                 alias_address = alias.get('address') or str(alias_id)
                 if alias_id:
                     deletion_candidates["aliases"].append(alias_address)
-                    if delete_enabled:
-                        self.mailcow.deleteAlias(alias_id)
-                        logging.info(f"  * Deleted alias {alias_address}")
+                    alias_addresses[alias_id] = alias_address
+
+            if delete_enabled:
+                for alias_id, deleted in self.mailcow.deleteAliases(list(alias_addresses.keys())).items():
+                    if deleted:
+                        logging.info(f"  * Deleted alias {alias_addresses[alias_id]}")
 
             for mailbox in mailboxList.disableQueue():
                 # Get username from mailbox data
@@ -378,16 +495,20 @@ class EdulutionMailcowSync:
                         logging.debug(f"  * Skipping ignored mailbox from deletion: {username}")
                         continue
                     deletion_candidates["mailboxes"].append(username)
-                    if delete_enabled:
-                        self.mailcow.deleteMailbox(username)
+
+            if delete_enabled:
+                for username, deleted in self.mailcow.deleteMailboxes(deletion_candidates["mailboxes"]).items():
+                    if deleted:
                         logging.info(f"  * Deleted mailbox {username}")
 
             for domain in domainList.disableQueue():
                 domain_name = domain.get('domain_name')
                 if domain_name:
                     deletion_candidates["domains"].append(domain_name)
-                    if delete_enabled:
-                        self.mailcow.deleteDomain(domain_name)
+
+            if delete_enabled:
+                for domain_name, deleted in self.mailcow.deleteDomains(deletion_candidates["domains"]).items():
+                    if deleted:
                         logging.info(f"  * Deleted domain {domain_name}")
 
         # Log deletion candidates summary
@@ -437,7 +558,7 @@ class EdulutionMailcowSync:
             if "sophomorixMailQuotaCalculated" in user["attributes"]:
                 quota = user["attributes"]["sophomorixMailQuotaCalculated"][0] 
         active = 0 if user["attributes"]["sophomorixStatus"] in ["L", "D", "R", "K", "F"] else 1
-        return mailboxList.addElement({
+        element = {
             "domain": domain,
             "local_part": localPart,
             "active": active,
@@ -446,7 +567,10 @@ class EdulutionMailcowSync:
             "password2": password,
             "name": user["firstName"] + " " + user["lastName"],
             "tags": [MANAGED_TAG_MAILBOX]
-        }, mail)
+        }
+        if self._skipUnchanged("mailboxes", mail, element, mailboxList):
+            return True
+        return mailboxList.addElement(element, mail)
     
     def _addAliasesFromProxyAddresses(self, user: dict, mail: str, mailcowAliases: str | list) -> bool:
         aliases = []
@@ -467,6 +591,14 @@ class EdulutionMailcowSync:
         # Convert goto to list if needed
         new_members = goto if isinstance(goto, list) else [goto]
 
+        if self._skipUnchanged("aliases", alias, {
+            "address": alias,
+            "goto": sorted(new_members),
+            "sogo_visible": sogo_visible,
+            "track_member_changes": track_member_changes
+        }, aliasList):
+            return True
+
         # If soft-delete is enabled and this is a group alias (sogo_visible=0), track member changes
         if track_member_changes and self._config.SOFT_DELETE_ENABLED and sogo_visible == 0:
             # Get current members from Mailcow if alias exists
@@ -485,6 +617,10 @@ class EdulutionMailcowSync:
 
             # Use the final member list
             goto_targets = ",".join(final_members)
+
+            # Members in grace period need a new mark in every cycle, so don't skip this alias next time
+            if self.syncSnapshot is not None and set(final_members) != set(new_members):
+                self.syncSnapshot.forget("aliases", alias)
         else:
             # No tracking, use goto as-is
             goto_targets = ",".join(new_members) if isinstance(new_members, list) else goto
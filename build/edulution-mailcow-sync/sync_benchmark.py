@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the sync loop (sync.py)
+
+Starts a fake Keycloak and a fake Mailcow API on localhost, seeds Keycloak with a
+synthetic school and runs EdulutionMailcowSync._sync against them:
+
+    1. Initial sync into an empty mailcow, the first cycle only creates the domain
+    2. Initial sync of mailboxes and aliases
+    3. Two syncs without changes, the first one after writes is always a full reconcile
+    4. Sync after a school year change (leavers, new students, class changes)
+    5. Syncs while the leavers wait out their grace period, deactivated mailboxes must
+       not be written again
+
+For every cycle the duration, the duration of each phase, the number of requests and
+whether it ran incrementally or as a full reconcile are reported, so performance regressions can be found without a live stack.
+
+Usage:
+    python3 sync_benchmark.py [--students 1000] [--teachers 80] [--class-size 25] [--latency 0] [--output result.json]
+
+Inside Docker container:
+    docker exec edulution-mail /app/venv/bin/python3 /app/sync_benchmark.py
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DOMAIN = "schule.lan"
+MEBIBYTE = 1024 * 1024
+
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannah", "Ida", "Jonas",
+               "Karl", "Lena", "Mia", "Noah", "Oskar", "Paul", "Romy", "Sophie", "Tom", "Vincent"]
+LAST_NAMES = ["Bauer", "Becker", "Fischer", "Hoffmann", "Koch", "Meyer", "Müller", "Richter", "Schäfer",
+              "Schmidt", "Schneider", "Schulz", "Wagner", "Weber", "Wolf", "Zimmermann"]
+
+# ========================================================================================
+# Synthetic school
+
+class School:
+    """Users and groups of a school in the representation of the keycloak admin api"""
+
+    def __init__(self, students: int, teachers: int, class_size: int):
+        self.class_size = class_size
+        self.users = {}
+        self.roles = {"role-student": [], "role-teacher": []}
+        self.classes = {}
+        self._next_user = 0
+
+        for _ in range(max(1, students // class_size)):
+            self._addClass()
+        for _ in range(students):
+            self._addUser("role-student", random.choice(list(self.classes)))
+        for _ in range(teachers):
+            teacher = self._addUser("role-teacher")
+            for class_name in random.sample(list(self.classes), min(3, len(self.classes))):
+                self.classes[class_name]["members"].append(teacher)
+
+        self.groups = self._buildGroups()
+
+    def _addClass(self) -> str:
+        name = f"klasse{len(self.classes) + 1:03d}"
+        self.classes[name] = {"id": str(uuid.uuid4()), "members": []}
+        return name
+
+    def _addUser(self, role: str, class_name: str = None) -> str:
+        self._next_user += 1
+        username = f"{'s' if role == 'role-student' else 'l'}{self._next_user:06d}"
+        self.users[username] = {
+            "id": str(uuid.uuid4()),
+            "username": username,
+            "email": f"{username}@{DOMAIN}",
+            "firstName": random.choice(FIRST_NAMES),
+            "lastName": random.choice(LAST_NAMES),
+            "enabled": True,
+            "attributes": {
+                "sophomorixStatus": ["U"],
+                "sophomorixMailQuotaCalculated": ["1000"],
+                "proxyAddresses": [f"{username}.alias@{DOMAIN}"]
+            }
+        }
+        self.roles[role].append(username)
+        if class_name:
+            self.classes[class_name]["members"].append(username)
+        return username
+
+    def _buildGroups(self) -> dict:
+        groups = {}
+        for role, members in self.roles.items():
+            groups[role] = {"id": str(uuid.uuid4()), "name": role, "attributes": {}, "members": members}
+        for class_name, data in self.classes.items():
+            groups[class_name] = {
+                "id": data["id"],
+                "name": class_name,
+                "attributes": {"mail": [f"{class_name}@{DOMAIN}"], "sophomorixMaillist": ["TRUE"]},
+                "members": data["members"]
+            }
+        return groups
+
+    def changeSchoolYear(self, ratio: float) -> dict:
+        """Remove leavers, add new students and move some students to another class"""
+        students = list(self.roles["role-student"])
+        count = max(1, int(len(students) * ratio))
+
+        leavers = random.sample(students, count)
+        for username in leavers:
+            del self.users[username]
+            self.roles["role-student"].remove(username)
+            for data in self.classes.values():
+                if username in data["members"]:
+                    data["members"].remove(username)
+
+        new_class = self._addClass()
+        for _ in range(count):
+            self._addUser("role-student", new_class)
+
+        remaining = [username for username in self.roles["role-student"] if username not in self.classes[new_class]["members"]]
+        moved = random.sample(remaining, min(count, len(remaining)))
+        for username in moved:
+            for data in self.classes.values():
+                if username in data["members"]:
+                    data["members"].remove(username)
+            random.choice(list(self.classes.values()))["members"].append(username)
+
+        self.groups = self._buildGroups()
+        return {"leavers": len(leavers), "new_students": count, "moved": len(moved)}
+
+    def member(self, username: str) -> dict:
+        user = self.users[username]
+        return {key: user[key] for key in ["id", "username", "email", "firstName", "lastName"]}
+
+    def groupSummary(self, group: dict) -> dict:
+        return {"id": group["id"], "name": group["name"], "path": "/" + group["name"], "subGroupCount": 0}
+
+# ========================================================================================
+# Fake servers
+
+class FakeServer:
+    """Threaded JSON http server with an optional latency per request"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.request_count = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def _handle(self, method: str):
+                with fake._lock:
+                    fake.request_count += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                status, result = fake.handle(method, url.path.lstrip("/"), query, body)
+                data = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> tuple:
+        raise NotImplementedError
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+class FakeKeycloak(FakeServer):
+    """The parts of the keycloak admin api used by the sync"""
+
+    def __init__(self, school: School, latency: float):
+        self.school = school
+        super().__init__(latency)
+
+    def handle(self, method, path, query, body):
+        parts = path.split("/")
+
+        if path.endswith("protocol/openid-connect/token"):
+            return 200, {"access_token": "benchmark", "expires_in": 3600, "refresh_expires_in": 0, "token_type": "Bearer"}
+
+        if parts[:3] != ["admin", "realms", "edulution"]:
+            return 404, {"error": "not found"}
+        parts = parts[3:]
+
+        if parts == ["users", "count"]:
+            return 200, len(self.school.users)
+
+        if parts == ["users"]:
+            users = list(self.school.users.values())
+            return 200, self._page(users, query)
+
+        if parts == ["groups"]:
+            groups = list(self.school.groups.values())
+            if "search" in query:
+                groups = [group for group in groups if query["search"].lower() in group["name"].lower()]
+            return 200, self._page([self.school.groupSummary(group) for group in groups], query)
+
+        if len(parts) >= 2 and parts[0] == "groups":
+            group = next((group for group in self.school.groups.values() if group["id"] == parts[1]), None)
+            if group is None:
+                return 404, {"error": "Could not find group by id"}
+            if len(parts) == 2:
+                return 200, {**self.school.groupSummary(group), "attributes": group["attributes"], "subGroups": []}
+            if parts[2] == "members":
+                return 200, self._page([self.school.member(username) for username in group["members"]], query)
+            if parts[2] == "children":
+                return 200, []
+
+        return 404, {"error": "not found"}
+
+    def _page(self, elements: list, query: dict) -> list:
+        first = int(query.get("first", 0))
+        if "max" not in query:
+            return elements[first:]
+        return elements[first:first + int(query["max"])]
+
+
+class FakeMailcow(FakeServer):
+    """In-memory mailcow api that keeps what the sync writes"""
+
+    domainKeys = {"maxquota": "max_quota_for_mbox", "defquota": "def_quota_for_mbox", "quota": "max_quota_for_domain",
+                  "mailboxes": "max_num_mboxes_for_domain", "aliases": "max_num_aliases_for_domain"}
+    domainQuotaKeys = ["max_quota_for_mbox", "def_quota_for_mbox", "max_quota_for_domain"]
+    ignoredKeys = ["password", "password2", "restart_sogo"]
+
+    def __init__(self, latency: float):
+        self.domains = {}
+        self.mailboxes = {}
+        self.aliases = {}
+        self.filters = {}
+        self._next_alias_id = 1
+        super().__init__(latency)
+
+    def handle(self, method, path, query, body):
+        parts = path.split("/")
+        if parts[:2] != ["api", "v1"] or len(parts) < 4:
+            return 404, {"error": "not found"}
+        action, objectType = parts[2], parts[3]
+        data = json.loads(body) if body else None
+
+        with self._lock:
+            if action == "get":
+                return 200, self._get(objectType)
+            if action == "add":
+                return 200, self._add(objectType, data)
+            if action == "edit":
+                return 200, self._edit(objectType, data)
+            if action == "delete":
+                return 200, self._delete(objectType, data)
+
+        return 404, {"error": "not found"}
+
+    def _get(self, objectType: str) -> list:
+        if objectType == "domain":
+            result = []
+            for name, domain in self.domains.items():
+                result.append({
+                    **domain,
+                    "mboxes_in_domain": sum(1 for mailbox in self.mailboxes.values() if mailbox["domain"] == name),
+                    "aliases_in_domain": sum(1 for alias in self.aliases.values() if alias["domain"] == name)
+                })
+            return result
+        if objectType == "mailbox":
+            return list(self.mailboxes.values())
+        if objectType == "alias":
+            return list(self.aliases.values())
+        if objectType == "filters":
+            return list(self.filters.values())
+        return []
+
+    def _convertDomain(self, attributes: dict) -> dict:
+        result = {}
+        for key, value in attributes.items():
+            key = self.domainKeys.get(key, key)
+            result[key] = int(value) * MEBIBYTE if key in self.domainQuotaKeys else value
+        return result
+
+    def _convertMailbox(self, attributes: dict) -> dict:
+        return {key: int(value) * MEBIBYTE if key == "quota" else value for key, value in attributes.items()}
+
+    def _add(self, objectType: str, data: dict) -> list:
+        data = {key: value for key, value in data.items() if key not in self.ignoredKeys}
+
+        if objectType == "domain":
+            self.domains[data["domain"]] = {"domain_name": data["domain"], **self._convertDomain(data)}
+            return [{"type": "success", "msg": ["domain_added", data["domain"]]}]
+
+        if objectType == "mailbox":
+            username = f"{data['local_part']}@{data['domain']}"
+            if data["domain"] not in self.domains:
+                return [{"type": "danger", "msg": ["domain_not_found", data["domain"]]}]
+            self.mailboxes[username] = {"username": username, **self._convertMailbox(data)}
+            return [{"type": "success", "msg": ["mailbox_added", username]}]
+
+        if objectType == "alias":
+            self.aliases[data["address"]] = {"id": self._next_alias_id, "domain": data["address"].split("@")[-1], **data}
+            self._next_alias_id += 1
+            return [{"type": "success", "msg": ["alias_added", data["address"]]}]
+
+        return [{"type": "danger", "msg": ["unknown_type", objectType]}]
+
+    def _edit(self, objectType: str, data: dict) -> list:
+        attributes = {key: value for key, value in data["attr"].items() if key not in self.ignoredKeys}
+        results = []
+
+        for item in data["items"]:
+            if objectType == "domain" and item in self.domains:
+                self.domains[item].update(self._convertDomain(attributes))
+            elif objectType == "mailbox" and item in self.mailboxes:
+                self.mailboxes[item].update(self._convertMailbox(attributes))
+            elif objectType == "alias" and item in self.aliases:
+                self.aliases[item].update(attributes)
+            else:
+                results.append({"type": "danger", "msg": ["object_not_found", item]})
+                continue
+            results.append({"type": "success", "msg": [f"{objectType}_modified", item]})
+
+        return results
+
+    def _delete(self, objectType: str, items: list) -> list:
+        results = []
+        for item in items:
+            if objectType == "domain":
+                found = self.domains.pop(item, None)
+            elif objectType == "mailbox":
+                found = self.mailboxes.pop(item, None)
+            elif objectType == "alias":
+                address = next((address for address, alias in self.aliases.items() if str(alias["id"]) == str(item) or address == item), None)
+                found = self.aliases.pop(address, None) if address else None
+            else:
+                found = self.filters.pop(item, None)
+
+            if found is None:
+                results.append({"type": "danger", "msg": ["object_not_found", item]})
+            else:
+                results.append({"type": "success", "msg": [f"{objectType}_removed", item]})
+
+        return results
+
+# ========================================================================================
+# Benchmark
+
+def run_cycle(label: str, syncer, keycloak: FakeKeycloak, mailcow: FakeMailcow) -> dict:
+    keycloak.request_count = 0
+    mailcow.request_count = 0
+    before = syncer.metrics.getRequestCounts()
+
+    start = time.perf_counter()
+    success = syncer._sync()
+    duration = time.perf_counter() - start
+
+    after = syncer.metrics.getRequestCounts()
+    requests = {f"{service} {endpoint}": count - before.get((service, endpoint), 0) for (service, endpoint), count in after.items()}
+    requests = {key: count for key, count in requests.items() if count > 0}
+
+    result = {
+        "label": label,
+        "success": success,
+        "mode": "incremental" if syncer._incrementalCycle else "full",
+        "duration": duration,
+        "phases": syncer.metrics.getPhaseDurations(),
+        "keycloak_requests": keycloak.request_count,
+        "mailcow_requests": mailcow.request_count,
+        "requests": requests,
+        "mailcow_writes": sum(count for key, count in requests.items() if key.startswith("mailcow") and "/get/" not in key),
+        "mailboxes": len(mailcow.mailboxes),
+        "aliases": len(mailcow.aliases)
+    }
+
+    print(f"{label:<32} {duration:8.2f} s   keycloak {keycloak.request_count:6d} req   mailcow {mailcow.request_count:6d} req ({result['mailcow_writes']:5d} writes)   {result['mode']:<11}   {'OK' if success else 'FAILED'}")
+    for phase, phaseDuration in result["phases"].items():
+        print(f"    {phase:<28} {phaseDuration:8.2f} s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync loop against fake keycloak and mailcow servers")
+    parser.add_argument("--students", type=int, default=1000, help="Number of students (default: 1000)")
+    parser.add_argument("--teachers", type=int, default=80, help="Number of teachers (default: 80)")
+    parser.add_argument("--class-size", type=int, default=25, help="Students per class (default: 25)")
+    parser.add_argument("--change", type=float, default=0.1, help="Ratio of students changed for the school year change (default: 0.1)")
+    parser.add_argument("--latency", type=float, default=0, help="(ms) Added latency per request of the fake servers (default: 0)")
+    parser.add_argument("--mark-count", type=int, default=2, help="SOFT_DELETE_MARK_COUNT, syncs until leavers are deactivated (default: 2)")
+    parser.add_argument("--incremental", action="store_true", help="Run the sync with INCREMENTAL_SYNC=1")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show the log of the sync")
+    args = parser.parse_args()
+
+    random.seed(42)
+    school = School(args.students, args.teachers, args.class_size)
+    keycloak = FakeKeycloak(school, args.latency / 1000)
+    mailcow = FakeMailcow(args.latency / 1000)
+
+    with tempfile.TemporaryDirectory() as mailcowPath:
+        os.environ.update({
+            "LOG_LEVEL": "INFO" if args.verbose else "ERROR",
+            "KEYCLOAK_SERVER_URL": keycloak.url + "/",
+            "KEYCLOAK_SECRET_KEY": "benchmark",
+            "MAILCOW_API_TOKEN": "benchmark",
+            "MAILCOW_PATH": mailcowPath,
+            "INCREMENTAL_SYNC": "1" if args.incremental else "0",
+            "DELETE_ENABLED": "1",
+            "SOFT_DELETE_MARK_COUNT": str(args.mark_count),
+            "METRICS_PORT": "0",
+            "METRICS_TEXTFILE": ""
+        })
+
+        from sync import EdulutionMailcowSync
+        from modules import Mailcow
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+        syncer = EdulutionMailcowSync()
+        syncer.mailcow = Mailcow(apiToken="benchmark", concurrency=syncer._config.MAILCOW_CONCURRENCY, baseUrl=mailcow.url)
+        syncer.mailcow.metrics = syncer.metrics
+
+        print(f"School: {len(school.users)} users, {len(school.classes)} classes, latency {args.latency:g} ms, incremental {'on' if args.incremental else 'off'}")
+        print("-" * 100)
+        results = [
+            run_cycle("Initial sync (domain)", syncer, keycloak, mailcow),
+            run_cycle("Initial sync (mailboxes)", syncer, keycloak, mailcow),
+            run_cycle("Sync without changes", syncer, keycloak, mailcow),
+            run_cycle("Sync without changes (2)", syncer, keycloak, mailcow)
+        ]
+        changes = school.changeSchoolYear(args.change)
+        results.append(run_cycle(f"School year change ({args.change:.0%})", syncer, keycloak, mailcow))
+
+        # Leavers are deactivated after the mark count is reached and then wait out the grace period
+        for cycle in range(args.mark_count + 2):
+            results.append(run_cycle(f"Grace period (cycle {cycle + 1})", syncer, keycloak, mailcow))
+        print("-" * 100)
+        print(f"School year change: {changes['leavers']} leavers, {changes['new_students']} new students, {changes['moved']} moved")
+        print(f"Mailcow now has {len(mailcow.mailboxes)} mailboxes and {len(mailcow.aliases)} aliases")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"arguments": vars(args), "changes": changes, "cycles": results}, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    keycloak.shutdown()
+    mailcow.shutdown()
+
+    if not all(result["success"] for result in results):
+        raise SystemExit(1)
+
+    if results[-1]["mailcow_writes"]:
+        print(f"ERROR: {results[-1]['mailcow_writes']} mailcow writes in the grace period without any change!")
+        raise SystemExit(1)
+
+    if args.incremental and results[-1]["mode"] != "incremental":
+        print("ERROR: the last grace period cycle was not incremental!")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
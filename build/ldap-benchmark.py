@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the LDAP tree of the SQL-to-LDAP bridge (ldap-server.py)
+
+Builds a synthetic GAL without MySQL and measures a full build, an update without
+changes and an incremental update.
+
+Usage:
+    python3 ldap-benchmark.py [--users 20000] [--groups 2000] [--members 30] [--change 0.01]
+
+Inside Docker container:
+    docker exec edulution-mail /app/venv/bin/python3 /app/ldap-benchmark.py
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import time
+
+def load_ldap_server():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ldap-server.py")
+    spec = importlib.util.spec_from_file_location("ldap_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannah", "Ida", "Jonas",
+               "Karl", "Lena", "Mia", "Noah", "Oskar", "Paul", "Romy", "Sophie", "Tom", "Vincent"]
+LAST_NAMES = ["Bauer", "Becker", "Fischer", "Hoffmann", "Koch", "Meyer", "Müller", "Richter", "Schäfer",
+              "Schmidt", "Schneider", "Schulz", "Wagner", "Weber", "Wolf", "Zimmermann"]
+
+def generate_rows(user_count, group_count, members_per_group):
+    users = []
+    for i in range(user_count):
+        uid = f"user{i:06d}"
+        users.append({
+            "c_uid": uid,
+            "c_cn": f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}{i}",
+            "c_name": uid,
+            "mail": f"{uid}@schule.lan",
+        })
+
+    groups = []
+    for i in range(group_count):
+        members = random.sample(users, min(members_per_group, len(users)))
+        groups.append({
+            "c_uid": f"group{i:05d}@schule.lan",
+            "c_cn": f"Klasse {i}",
+            "mail": f"group{i:05d}@schule.lan",
+            "groupMembers": " ".join(member["mail"] for member in members),
+        })
+
+    return users, groups
+
+def modify_rows(users, groups, change_ratio):
+    """Rename some users, replace a member in some groups, add and remove a few rows"""
+    users = [dict(user) for user in users]
+    groups = [dict(group) for group in groups]
+
+    for user in random.sample(users, max(1, int(len(users) * change_ratio))):
+        user["c_cn"] = user["c_cn"] + " Geändert"
+
+    for group in random.sample(groups, max(1, int(len(groups) * change_ratio))):
+        members = group["groupMembers"].split()
+        if members:
+            members[random.randrange(len(members))] = random.choice(users)["mail"]
+        group["groupMembers"] = " ".join(members)
+
+    removed = users.pop()
+    users.append({
+        "c_uid": "newuser",
+        "c_cn": "Neu Benutzer",
+        "c_name": "newuser",
+        "mail": "newuser@schule.lan",
+    })
+    groups.pop()
+
+    return users, groups, removed
+
+def measure(label, function):
+    start = time.perf_counter()
+    result = function()
+    duration = (time.perf_counter() - start) * 1000
+    print(f"{label:<40} {duration:10.1f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full and incremental LDAP tree updates")
+    parser.add_argument("--users", type=int, default=20000, help="Number of users (default: 20000)")
+    parser.add_argument("--groups", type=int, default=2000, help="Number of groups (default: 2000)")
+    parser.add_argument("--members", type=int, default=30, help="Members per group (default: 30)")
+    parser.add_argument("--change", type=float, default=0.01, help="Ratio of modified rows for the incremental update (default: 0.01)")
+    args = parser.parse_args()
+
+    ldap_server = load_ldap_server()
+    ldap_server.logger.setLevel(logging.WARNING)
+    random.seed(42)
+
+    users, groups = generate_rows(args.users, args.groups, args.members)
+    modified_users, modified_groups, _ = modify_rows(users, groups, args.change)
+
+    print(f"GAL: {args.users} users, {args.groups} groups, {args.members} members per group")
+    print("-" * 52)
+
+    tree = ldap_server.GalTree()
+    measure("Full build", lambda: tree.update(users, groups))
+    measure("Update without changes", lambda: tree.update(users, groups))
+    stats = measure(f"Incremental update ({args.change:.1%} changed)", lambda: tree.update(modified_users, modified_groups))
+
+    print("-" * 52)
+    print(f"Incremental update rebuilt {stats['users_changed']} users and {stats['groups_changed']} groups, "
+          f"removed {stats['users_removed']} users and {stats['groups_removed']} groups")
+
+if __name__ == "__main__":
+    main()
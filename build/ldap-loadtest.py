@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search load test for the SQL-to-LDAP bridge (ldap-server.py)
+
+Runs SOGo-like searches (group expansion, address lookups and autocomplete) against a
+synthetic GAL and reports p50/p99 latency with and without the search indexes. The
+results of both paths are compared, so the indexes can't silently change answers.
+
+Usage:
+    python3 ldap-loadtest.py [--users 20000] [--groups 2000] [--searches 500]
+
+Inside Docker container:
+    docker exec edulution-mail /app/venv/bin/python3 /app/ldap-loadtest.py
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import time
+
+from ldaptor import ldapfilter
+from ldaptor.protocols import pureber, pureldap
+
+def load_module(name, filename):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def build_searches(users, groups, count):
+    """Return (base, scope, filter text) tuples like the ones SOGo sends"""
+    searches = []
+    for _ in range(count):
+        user = random.choice(users)
+        group = random.choice(groups)
+        prefix = user["c_cn"][:random.randint(3, 8)]
+        searches.append(random.choice([
+            (b"ou=groups,dc=schule,dc=lan", pureldap.LDAP_SCOPE_wholeSubtree, f"(mail={group['mail']})"),
+            (b"ou=users,dc=schule,dc=lan", pureldap.LDAP_SCOPE_wholeSubtree, f"(mail={user['mail']})"),
+            (b"ou=users,dc=schule,dc=lan", pureldap.LDAP_SCOPE_singleLevel, f"(uid={user['c_uid']})"),
+            (b"dc=schule,dc=lan", pureldap.LDAP_SCOPE_wholeSubtree, f"(|(cn={prefix}*)(mail={prefix}*)(displayName={prefix}*))"),
+            (b"dc=schule,dc=lan", pureldap.LDAP_SCOPE_wholeSubtree, f"(&(objectClass=groupOfUniqueNames)(mail={group['mail']}))"),
+        ]))
+    return searches
+
+def parse_filter(filter_text):
+    """Parse a filter and round-trip it through BER, so values are bytes like on the wire"""
+    context = pureldap.LDAPBERDecoderContext(fallback=pureber.BERDecoderContext())
+    decoded, _ = pureber.berDecodeObject(
+        pureldap.LDAPBERDecoderContext_Filter(fallback=context, inherit=context),
+        ldapfilter.parseFilter(filter_text).toWire()
+    )
+    return decoded
+
+def run_search(ldap_server, tree, base, scope, filter_text):
+    entry = {
+        b"dc=schule,dc=lan": tree.root,
+        b"ou=users,dc=schule,dc=lan": tree.ou_users,
+        b"ou=groups,dc=schule,dc=lan": tree.ou_groups,
+    }[base]
+
+    results = []
+    entry.search(filterObject=parse_filter(filter_text), scope=scope, callback=results.append)
+    return sorted(result.dn.getText() for result in results)
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def measure(label, ldap_server, tree, searches, use_index):
+    ldap_server.LDAP_SEARCH_INDEX = use_index
+    latencies = []
+    answers = []
+    for base, scope, filter_text in searches:
+        start = time.perf_counter()
+        answers.append(run_search(ldap_server, tree, base, scope, filter_text))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    print(f"{label:<20} p50 {percentile(latencies, 0.50):9.2f} ms   p99 {percentile(latencies, 0.99):9.2f} ms")
+    return answers
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure LDAP search latency with and without indexes")
+    parser.add_argument("--users", type=int, default=20000, help="Number of users (default: 20000)")
+    parser.add_argument("--groups", type=int, default=2000, help="Number of groups (default: 2000)")
+    parser.add_argument("--members", type=int, default=30, help="Members per group (default: 30)")
+    parser.add_argument("--searches", type=int, default=500, help="Number of searches per run (default: 500)")
+    args = parser.parse_args()
+
+    ldap_server = load_module("ldap_server", "ldap-server.py")
+    benchmark = load_module("ldap_benchmark", "ldap-benchmark.py")
+    ldap_server.logger.setLevel(logging.WARNING)
+    random.seed(42)
+
+    users, groups = benchmark.generate_rows(args.users, args.groups, args.members)
+    tree = ldap_server.GalTree()
+    tree.update(users, groups)
+    searches = build_searches(users, groups, args.searches)
+
+    print(f"GAL: {args.users} users, {args.groups} groups, {args.searches} searches")
+    print("-" * 60)
+    indexed = measure("With indexes", ldap_server, tree, searches, True)
+    walked = measure("Without indexes", ldap_server, tree, searches, False)
+    print("-" * 60)
+
+    mismatches = sum(1 for a, b in zip(indexed, walked) if a != b)
+    if mismatches:
+        print(f"ERROR: {mismatches} searches returned different results with indexes!")
+        raise SystemExit(1)
+    print("Results with and without indexes are identical")
+
+if __name__ == "__main__":
+    main()
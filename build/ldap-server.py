@@ -7,17 +7,21 @@ Loads users and groups dynamically from MySQL edulution_gal table
 PERFORMANCE NOTES for large deployments (2000+ users):
 - Recommended SQL index: CREATE INDEX idx_edulution_gal_lookup ON edulution_gal(isGroup, mail);
 - Memory usage: ~1.5 KB per user, ~2 KB per group (~3.5 MB for 2000 users)
-- Tree rebuild: ~150-700ms every 60 seconds (acceptable)
-- LDAP queries: Async/non-blocking (handles concurrent requests well)
+- Tree refresh: every 60 seconds in a worker thread, only added/removed/modified rows
+  are rebuilt (see ldap-benchmark.py), the reactor only swaps the prepared entries
+- LDAP queries: Async/non-blocking (handles concurrent requests well), equality and
+  prefix filters on mail/uid/cn/displayName are answered from indexes (see ldap-loadtest.py)
 """
 import logging
 import os
 import time
 import hashlib
+import bisect
 import mysql.connector
-from twisted.internet import reactor, task
+from twisted.internet import defer, reactor, task, threads
 from twisted.internet.protocol import Factory
 from ldaptor.inmemory import ReadOnlyInMemoryLDAPEntry
+from ldaptor.protocols import pureldap
 from ldaptor.protocols.ldap.ldapserver import LDAPServer
 from ldaptor.interfaces import IConnectedLDAPEntry
 from zope.interface import implementer
@@ -26,6 +30,7 @@ from zope.interface import implementer
 # LOGGING SETUP
 # ------------------------------------------------------------
 LDAP_DEBUG = os.getenv('LDAP_DEBUG', 'false').lower() == 'true'
+LDAP_SEARCH_INDEX = os.getenv('LDAP_SEARCH_INDEX', 'true').lower() == 'true'
 
 logging.basicConfig(
     level=logging.DEBUG if LDAP_DEBUG else logging.INFO,
@@ -43,33 +48,29 @@ DB_CONFIG = {
     'database': os.getenv('DBNAME', 'mailcow')
 }
 
-# Global LDAP tree and cache
-ldap_root = None
-last_data_hash = None
+BASE_DN = "dc=schule,dc=lan"
+USER_COLUMNS = ("c_uid", "c_cn", "c_name", "mail")
+GROUP_COLUMNS = ("c_uid", "c_cn", "mail", "groupMembers")
 
 # ------------------------------------------------------------
-# BUILD LDAP TREE FROM MYSQL
+# LOAD ROWS FROM MYSQL
 # ------------------------------------------------------------
-def build_ldap_tree_from_sql():
-    """Query MySQL edulution_gal and build LDAP tree"""
-    global ldap_root, last_data_hash
-
-    start_time = time.time()
+def fetch_gal_rows():
+    """Query users and groups from MySQL edulution_gal (blocking, run outside of the reactor)"""
+    # Log DB connection details (with masked password)
+    if LDAP_DEBUG:
+        masked_config = DB_CONFIG.copy()
+        masked_config['password'] = '***' if DB_CONFIG.get('password') else '(empty)'
+        logger.debug(f"Connecting to MySQL: {masked_config}")
 
-    try:
-        # Log DB connection details (with masked password)
-        if LDAP_DEBUG:
-            masked_config = DB_CONFIG.copy()
-            masked_config['password'] = '***' if DB_CONFIG.get('password') else '(empty)'
-            logger.debug(f"Connecting to MySQL: {masked_config}")
+    # Connect to MySQL
+    db = mysql.connector.connect(**DB_CONFIG)
+    cursor = db.cursor(dictionary=True)
 
-        # Connect to MySQL
-        db = mysql.connector.connect(**DB_CONFIG)
-        cursor = db.cursor(dictionary=True)
-
-        if LDAP_DEBUG:
-            logger.debug("✓ MySQL connection established")
+    if LDAP_DEBUG:
+        logger.debug("✓ MySQL connection established")
 
+    try:
         # Get all users (isGroup IS NULL or isGroup = 0)
         # NOTE: Uses index on (isGroup, mail) for optimal performance
         if LDAP_DEBUG:
@@ -92,21 +93,6 @@ def build_ldap_tree_from_sql():
             if len(users) > 5:
                 logger.debug(f"  ... and {len(users) - 5} more users")
 
-        # Create email -> c_uid lookup map AND pre-build DNs for performance
-        email_to_uid = {}
-        email_to_dn = {}
-        for user in users:
-            uid = user['c_uid']
-            email = user['mail']
-            email_to_uid[email] = uid
-            # Also map c_uid to itself for flexibility
-            email_to_uid[uid] = uid
-
-            # Pre-build DN strings (performance optimization)
-            dn_str = f"uid={uid},ou=users,dc=schule,dc=lan"
-            email_to_dn[email] = dn_str.encode('utf-8')
-            email_to_dn[uid] = dn_str.encode('utf-8')
-
         # Get all groups (isGroup = 1)
         # NOTE: Uses index on (isGroup, mail) for optimal performance
         if LDAP_DEBUG:
@@ -131,30 +117,236 @@ def build_ldap_tree_from_sql():
                 logger.debug(f"  Group {i+1}: id={group['c_uid']}, name='{display_name}', mail={group['mail']}, members={len(member_list)}")
                 if member_list:
                     logger.debug(f"    → Members: {', '.join(member_list[:10])}{'...' if len(member_list) > 10 else ''}")
-
+    finally:
         cursor.close()
         db.close()
 
-        # Check if data changed using hash (performance optimization)
-        # Create hash from user count, group count, and first/last entries
-        data_fingerprint = f"{len(users)}:{len(groups)}"
-        if users:
-            data_fingerprint += f":{users[0]['c_uid']}:{users[-1]['c_uid']}"
-        if groups:
-            data_fingerprint += f":{groups[0]['c_uid']}:{groups[-1].get('groupMembers', '')[:100]}"
+    return users, groups
+
+def row_fingerprint(row, columns):
+    """Hash over all selected columns of one edulution_gal row"""
+    values = "\x1f".join("" if row.get(column) is None else str(row.get(column)) for column in columns)
+    return hashlib.md5(values.encode('utf-8')).hexdigest()
+
+def user_dn(uid):
+    return f"uid={uid},ou=users,{BASE_DN}".encode('utf-8')
+
+def build_user_entry(user):
+    uid = user['c_uid']
+    cn = user.get('c_cn') or uid
+    mail = user['mail']
+
+    # Extract first/last name from c_cn
+    if ' ' in cn:
+        parts = cn.split(maxsplit=1)
+        givenname = parts[0]
+        sn = parts[1] if len(parts) > 1 else parts[0]
+    else:
+        givenname = cn
+        sn = cn
+
+    attributes = {
+        b"objectClass": [b"inetOrgPerson", b"person", b"top"],
+        b"uid": [uid.encode('utf-8')],
+        b"cn": [cn.encode('utf-8')],
+        b"sn": [sn.encode('utf-8')],
+        b"givenName": [givenname.encode('utf-8')],
+        b"mail": [mail.encode('utf-8')],
+    }
+    entry = ReadOnlyInMemoryLDAPEntry(dn=user_dn(uid), attributes=attributes)
+
+    rdn = f"uid={uid}".encode('utf-8')
+    return rdn, entry, attributes
+
+def build_group_entry(group, email_to_dn):
+    group_id = group['c_uid']  # e.g., "p_cgs-edu3@linuxmuster.lan"
+    # Get display name from c_cn (e.g., description from LDAP)
+    display_name = group.get('c_cn') or group_id
+    mail = group['mail']
+
+    # Build uniqueMember DNs by looking up pre-built DNs (performance optimized)
+    unique_members = []
+    missing_members = []
+
+    for member_email in group_member_emails(group):
+        # Direct lookup of pre-built DN (avoids string formatting + encoding)
+        member_dn = email_to_dn.get(member_email)
+        if member_dn:
+            unique_members.append(member_dn)
+        else:
+            # User not found - collect for batch warning
+            missing_members.append(member_email)
+
+    # Log missing members in batch (reduces log spam)
+    if missing_members and LDAP_DEBUG:
+        logger.warning(f"Group {group_id}: {len(missing_members)} member(s) not found: {', '.join(missing_members[:5])}{'...' if len(missing_members) > 5 else ''}")
+
+    # If no members, add dummy member (LDAP requires at least one)
+    if not unique_members:
+        unique_members = [f"cn=nobody,ou=users,{BASE_DN}".encode('utf-8')]
+
+    # IMPORTANT: cn in DN must match cn attribute value!
+    # Use group_id (email without domain) as cn, just like the old static version
+    # Extract local part from email for cleaner cn (e.g., "p_cgs-edu3" from "p_cgs-edu3@linuxmuster.lan")
+    cn_value = group_id.split('@')[0] if '@' in group_id else group_id
+
+    attributes = {
+        b"objectClass": [b"groupOfUniqueNames", b"top", b"extensibleObject"],
+        b"cn": [cn_value.encode('utf-8')],  # MUST match cn in DN
+        b"displayName": [display_name.encode('utf-8')],  # Human-readable name for SOGo
+        b"mail": [mail.encode('utf-8')],
+        b"uniqueMember": unique_members,
+        b"structuralObjectClass": [b"groupOfUniqueNames"],
+    }
+    entry = ReadOnlyInMemoryLDAPEntry(dn=f"cn={cn_value},ou=groups,{BASE_DN}".encode('utf-8'), attributes=attributes)
+
+    rdn = f"cn={cn_value}".encode('utf-8')
+    return rdn, entry, attributes
+
+def group_member_emails(group):
+    # Parse members (space-separated emails)
+    members_str = group.get('groupMembers') or ''
+    return members_str.strip().split() if members_str else []
+
+# ------------------------------------------------------------
+# SEARCH INDEXES
+# ------------------------------------------------------------
+def normalize_value(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return bytes(value).lower()
+
+class SearchIndex:
+    """
+    Hash indexes for equality and sorted indexes for prefix lookups, as sent by SOGo
+    for group expansion and autocomplete. Keys are lowercased, so a lookup returns
+    a superset of the matching entries; every candidate is checked with the real
+    filter before it is returned.
+    """
+
+    EQUALITY_ATTRIBUTES = (b"mail", b"uid", b"cn")
+    PREFIX_ATTRIBUTES = (b"cn", b"mail", b"displayname")
+
+    def __init__(self, partitions):
+        # attribute -> value -> [(partition, entry)]
+        self._equality = {attribute: {} for attribute in self.EQUALITY_ATTRIBUTES}
+        prefix = {attribute: [] for attribute in self.PREFIX_ATTRIBUTES}
+
+        for partition, items in partitions.items():
+            for entry, attributes in items:
+                for name, values in attributes.items():
+                    attribute = name.lower()
+                    if attribute in self._equality:
+                        for value in values:
+                            self._equality[attribute].setdefault(normalize_value(value), []).append((partition, entry))
+                    if attribute in prefix:
+                        for value in values:
+                            prefix[attribute].append((normalize_value(value), partition, entry))
+
+        # attribute -> (sorted keys, [(partition, entry)] in the same order)
+        self._prefix = {}
+        for attribute, items in prefix.items():
+            items.sort(key=lambda item: item[0])
+            self._prefix[attribute] = ([item[0] for item in items], [(item[1], item[2]) for item in items])
+
+    def candidates(self, filterObject):
+        """Return {id(entry): (partition, entry)} for an indexable filter, or None to fall back to a full walk"""
+        if isinstance(filterObject, pureldap.LDAPFilter_equalityMatch):
+            attribute = normalize_value(filterObject.attributeDesc.value)
+            if attribute not in self._equality:
+                return None
+            matches = self._equality[attribute].get(normalize_value(filterObject.assertionValue.value), [])
+            return {id(entry): (partition, entry) for partition, entry in matches}
+
+        if isinstance(filterObject, pureldap.LDAPFilter_substrings):
+            attribute = normalize_value(filterObject.type)
+            if attribute not in self._prefix or not filterObject.substrings:
+                return None
+            initial = filterObject.substrings[0]
+            if not isinstance(initial, pureldap.LDAPFilter_substrings_initial):
+                return None
+            return self._prefix_candidates(attribute, normalize_value(initial.value))
+
+        if isinstance(filterObject, pureldap.LDAPFilter_or):
+            result = {}
+            for child in filterObject:
+                child_candidates = self.candidates(child)
+                if child_candidates is None:
+                    return None
+                result.update(child_candidates)
+            return result
+
+        if isinstance(filterObject, pureldap.LDAPFilter_and):
+            result = None
+            for child in filterObject:
+                child_candidates = self.candidates(child)
+                if child_candidates is None:
+                    continue
+                if result is None:
+                    result = child_candidates
+                else:
+                    result = {key: value for key, value in result.items() if key in child_candidates}
+            return result
+
+        return None
+
+    def _prefix_candidates(self, attribute, prefix):
+        keys, items = self._prefix[attribute]
+        result = {}
+        position = bisect.bisect_left(keys, prefix)
+        while position < len(keys) and keys[position].startswith(prefix):
+            partition, entry = items[position]
+            result[id(entry)] = (partition, entry)
+            position += 1
+        return result
+
+class IndexedLDAPEntry(ReadOnlyInMemoryLDAPEntry):
+    """Root and OU entries which answer equality and prefix searches from the SearchIndex of their tree"""
+
+    def __init__(self, tree, partitions, scopes, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tree = tree
+        self._index_partitions = partitions
+        self._index_scopes = scopes
+
+    def search(self, filterText=None, filterObject=None, attributes=(), scope=None,
+               derefAliases=None, sizeLimit=0, timeLimit=0, typesOnly=0, callback=None):
+        search_index = self._tree.search_index
+        index_scope = pureldap.LDAP_SCOPE_wholeSubtree if scope is None else scope
+        if LDAP_SEARCH_INDEX and search_index is not None and filterObject is not None and filterText is None and index_scope in self._index_scopes:
+            candidates = search_index.candidates(filterObject)
+            if candidates is not None:
+                results = [entry for partition, entry in candidates.values()
+                           if partition in self._index_partitions and entry.match(filterObject)]
+                if callback is None:
+                    return defer.succeed(results)
+                for entry in results:
+                    callback(entry)
+                return defer.succeed(None)
+
+        # Any other filter or scope uses the generic in-memory search
+        return super().search(filterText=filterText, filterObject=filterObject, attributes=attributes, scope=scope,
+                              derefAliases=derefAliases, sizeLimit=sizeLimit, timeLimit=timeLimit,
+                              typesOnly=typesOnly, callback=callback)
 
-        current_hash = hashlib.md5(data_fingerprint.encode('utf-8')).hexdigest()
+# ------------------------------------------------------------
+# LDAP TREE WITH INCREMENTAL UPDATES
+# ------------------------------------------------------------
+class GalTree:
+    """
+    In-memory LDAP tree of the GAL.
 
-        if last_data_hash == current_hash and ldap_root is not None:
-            query_time = (time.time() - start_time) * 1000
-            logger.info(f"⏭ No changes detected, skipping tree rebuild ({query_time:.1f}ms)")
-            return ldap_root
+    Every row is fingerprinted, so an update only rebuilds the entries of rows which were
+    added, removed or modified. The children of ou=users and ou=groups are swapped as a
+    whole, searches never see a half updated tree.
+    """
 
-        last_data_hash = current_hash
+    def __init__(self):
+        self.search_index = None
 
-        # Build LDAP tree
-        root = ReadOnlyInMemoryLDAPEntry(
-            dn=b"dc=schule,dc=lan",
+        self.root = IndexedLDAPEntry(
+            self, ("users", "groups"), (pureldap.LDAP_SCOPE_wholeSubtree,),
+            dn=BASE_DN.encode('utf-8'),
             attributes={
                 b"objectClass": [b"domain"],
                 b"dc": [b"schule"]
@@ -162,140 +354,179 @@ def build_ldap_tree_from_sql():
         )
 
         # Create OUs
-        ou_users = ReadOnlyInMemoryLDAPEntry(
-            dn=b"ou=users,dc=schule,dc=lan",
+        self.ou_users = IndexedLDAPEntry(
+            self, ("users",), (pureldap.LDAP_SCOPE_singleLevel, pureldap.LDAP_SCOPE_wholeSubtree),
+            dn=f"ou=users,{BASE_DN}".encode('utf-8'),
             attributes={
                 b"objectClass": [b"organizationalUnit"],
                 b"ou": [b"users"]
             }
         )
 
-        ou_groups = ReadOnlyInMemoryLDAPEntry(
-            dn=b"ou=groups,dc=schule,dc=lan",
+        self.ou_groups = IndexedLDAPEntry(
+            self, ("groups",), (pureldap.LDAP_SCOPE_singleLevel, pureldap.LDAP_SCOPE_wholeSubtree),
+            dn=f"ou=groups,{BASE_DN}".encode('utf-8'),
             attributes={
                 b"objectClass": [b"organizationalUnit"],
                 b"ou": [b"groups"]
             }
         )
 
-        # Add users
-        user_entries = {}
+        self.ou_users._children = {}
+        self.ou_groups._children = {}
+        self.root._children = {
+            b"ou=users": self.ou_users,
+            b"ou=groups": self.ou_groups
+        }
+
+        # c_uid -> (fingerprint, row, rdn, entry, attributes)
+        self._users = {}
+        self._groups = {}
+
+    def compute_update(self, users, groups):
+        """
+        Build the new children of both OUs without touching the live tree.
+        Returns None if nothing changed, otherwise a tuple for apply_update().
+        """
+        # Users
+        new_users = {}
+        changed_users = 0
+        affected_members = set()  # Emails and uids whose DN changed, groups referencing them are rebuilt
         for user in users:
             uid = user['c_uid']
-            cn = user.get('c_cn') or uid
-            mail = user['mail']
-
-            # Extract first/last name from c_cn
-            if ' ' in cn:
-                parts = cn.split(maxsplit=1)
-                givenname = parts[0]
-                sn = parts[1] if len(parts) > 1 else parts[0]
-            else:
-                givenname = cn
-                sn = cn
-
-            dn_str = f"uid={uid},ou=users,dc=schule,dc=lan"
-            dn_bytes = dn_str.encode('utf-8')
-
-            entry = ReadOnlyInMemoryLDAPEntry(
-                dn=dn_bytes,
-                attributes={
-                    b"objectClass": [b"inetOrgPerson", b"person", b"top"],
-                    b"uid": [uid.encode('utf-8')],
-                    b"cn": [cn.encode('utf-8')],
-                    b"sn": [sn.encode('utf-8')],
-                    b"givenName": [givenname.encode('utf-8')],
-                    b"mail": [mail.encode('utf-8')],
-                },
-            )
-
-            rdn = f"uid={uid}".encode('utf-8')
-            user_entries[rdn] = entry
-
-        ou_users._children = user_entries
-
-        # Add groups
-        group_entries = {}
+            fingerprint = row_fingerprint(user, USER_COLUMNS)
+            current = self._users.get(uid)
+            if current is not None and current[0] == fingerprint:
+                new_users[uid] = current
+                continue
+
+            rdn, entry, attributes = build_user_entry(user)
+            new_users[uid] = (fingerprint, user, rdn, entry, attributes)
+            changed_users += 1
+            # Only a new user or a changed mail affects the uniqueMember lookup of groups
+            if current is None or current[1]['mail'] != user['mail']:
+                affected_members.update([uid, user['mail']])
+                if current is not None:
+                    affected_members.add(current[1]['mail'])
+
+        removed_users = [uid for uid in self._users if uid not in new_users]
+        for uid in removed_users:
+            affected_members.update([uid, self._users[uid][1]['mail']])
+
+        # Create email -> DN lookup map, c_uid is mapped as well for flexibility
+        email_to_dn = {}
+        for user in users:
+            dn = user_dn(user['c_uid'])
+            email_to_dn[user['mail']] = dn
+            email_to_dn[user['c_uid']] = dn
+
+        # Groups
+        new_groups = {}
+        changed_groups = 0
         for group in groups:
-            group_id = group['c_uid']  # e.g., "p_cgs-edu3@linuxmuster.lan"
-            # Get display name from c_cn (e.g., description from LDAP)
-            display_name = group.get('c_cn') or group_id
-            mail = group['mail']
-            members_str = group.get('groupMembers') or ''
-
-            # Parse members (space-separated emails)
-            member_emails = members_str.strip().split() if members_str else []
-
-            # Build uniqueMember DNs by looking up pre-built DNs (performance optimized)
-            unique_members = []
-            missing_members = []
-
-            for member_email in member_emails:
-                # Direct lookup of pre-built DN (avoids string formatting + encoding)
-                member_dn = email_to_dn.get(member_email)
-                if member_dn:
-                    unique_members.append(member_dn)
-                else:
-                    # User not found - collect for batch warning
-                    missing_members.append(member_email)
-
-            # Log missing members in batch (reduces log spam)
-            if missing_members and LDAP_DEBUG:
-                logger.warning(f"Group {group_id}: {len(missing_members)} member(s) not found: {', '.join(missing_members[:5])}{'...' if len(missing_members) > 5 else ''}")
-
-            # If no members, add dummy member (LDAP requires at least one)
-            if not unique_members:
-                unique_members = [b"cn=nobody,ou=users,dc=schule,dc=lan"]
-
-            # IMPORTANT: cn in DN must match cn attribute value!
-            # Use group_id (email without domain) as cn, just like the old static version
-            # Extract local part from email for cleaner cn (e.g., "p_cgs-edu3" from "p_cgs-edu3@linuxmuster.lan")
-            cn_value = group_id.split('@')[0] if '@' in group_id else group_id
-
-            dn_str = f"cn={cn_value},ou=groups,dc=schule,dc=lan"
-            dn_bytes = dn_str.encode('utf-8')
-
-            entry = ReadOnlyInMemoryLDAPEntry(
-                dn=dn_bytes,
-                attributes={
-                    b"objectClass": [b"groupOfUniqueNames", b"top", b"extensibleObject"],
-                    b"cn": [cn_value.encode('utf-8')],  # MUST match cn in DN
-                    b"displayName": [display_name.encode('utf-8')],  # Human-readable name for SOGo
-                    b"mail": [mail.encode('utf-8')],
-                    b"uniqueMember": unique_members,
-                    b"structuralObjectClass": [b"groupOfUniqueNames"],
-                },
-            )
-
-            rdn = f"cn={cn_value}".encode('utf-8')
-            group_entries[rdn] = entry
-
-        ou_groups._children = group_entries
-
-        # Build tree
-        root._children = {
-            b"ou=users": ou_users,
-            b"ou=groups": ou_groups
-        }
+            group_id = group['c_uid']
+            fingerprint = row_fingerprint(group, GROUP_COLUMNS)
+            current = self._groups.get(group_id)
+            if current is not None and current[0] == fingerprint:
+                if not affected_members or affected_members.isdisjoint(group_member_emails(group)):
+                    new_groups[group_id] = current
+                    continue
+
+            rdn, entry, attributes = build_group_entry(group, email_to_dn)
+            new_groups[group_id] = (fingerprint, group, rdn, entry, attributes)
+            changed_groups += 1
+
+        removed_groups = [group_id for group_id in self._groups if group_id not in new_groups]
+
+        if not changed_users and not removed_users and not changed_groups and not removed_groups:
+            return None
+
+        # Children are rebuilt from the row order, so duplicate rdns resolve like a full rebuild
+        user_children = {}
+        user_attributes = {}
+        for user in users:
+            _, _, rdn, entry, attributes = new_users[user['c_uid']]
+            user_children[rdn] = entry
+            user_attributes[rdn] = attributes
 
-        ldap_root = root
-        total_time = (time.time() - start_time) * 1000
-        logger.info(f"✅ LDAP tree rebuilt: {len(user_entries)} users, {len(group_entries)} groups ({total_time:.1f}ms total)")
+        group_children = {}
+        group_attributes = {}
+        for group in groups:
+            _, _, rdn, entry, attributes = new_groups[group['c_uid']]
+            group_children[rdn] = entry
+            group_attributes[rdn] = attributes
+
+        # Search indexes are rebuilt together with the tree
+        search_index = SearchIndex({
+            "users": [(user_children[rdn], attributes) for rdn, attributes in user_attributes.items()],
+            "groups": [(group_children[rdn], attributes) for rdn, attributes in group_attributes.items()],
+        })
+
+        stats = {
+            "users_changed": changed_users,
+            "users_removed": len(removed_users),
+            "groups_changed": changed_groups,
+            "groups_removed": len(removed_groups),
+        }
+        return new_users, new_groups, user_children, group_children, search_index, stats
+
+    def apply_update(self, update):
+        """Swap prepared children into the live tree (cheap, runs on the reactor thread)"""
+        new_users, new_groups, user_children, group_children, search_index, stats = update
+        self._users = new_users
+        self._groups = new_groups
+        self.ou_users._children = user_children
+        self.ou_groups._children = group_children
+        self.search_index = search_index
+        return stats
+
+    def update(self, users, groups):
+        update = self.compute_update(users, groups)
+        if update is None:
+            return None
+        return self.apply_update(update)
+
+# Global LDAP tree
+gal_tree = GalTree()
 
-        return root
+# ------------------------------------------------------------
+# BUILD LDAP TREE FROM MYSQL
+# ------------------------------------------------------------
+def compute_ldap_tree_update():
+    """Query MySQL edulution_gal and prepare the changed entries (blocking, run outside of the reactor)"""
+    start_time = time.time()
+    users, groups = fetch_gal_rows()
+    update = gal_tree.compute_update(users, groups)
+    return update, start_time
+
+def apply_ldap_tree_update(result):
+    update, start_time = result
+    total_time = (time.time() - start_time) * 1000
+
+    if update is None:
+        logger.info(f"⏭ No changes detected, skipping tree update ({total_time:.1f}ms)")
+        return gal_tree.root
+
+    stats = gal_tree.apply_update(update)
+    logger.info(
+        f"✅ LDAP tree updated: {len(gal_tree.ou_users._children)} users, {len(gal_tree.ou_groups._children)} groups "
+        f"(users changed/removed: {stats['users_changed']}/{stats['users_removed']}, "
+        f"groups changed/removed: {stats['groups_changed']}/{stats['groups_removed']}, {total_time:.1f}ms total)"
+    )
+    return gal_tree.root
+
+def log_ldap_tree_error(failure):
+    # Keep serving the current tree on errors
+    logger.error(f"Failed to build LDAP tree from SQL: {failure.getErrorMessage()}")
+    return gal_tree.root
 
+def build_ldap_tree_from_sql():
+    """Query MySQL edulution_gal and update the LDAP tree (blocking, used on startup)"""
+    try:
+        return apply_ldap_tree_update(compute_ldap_tree_update())
     except Exception as e:
         logger.error(f"Failed to build LDAP tree from SQL: {e}")
-        # Return minimal tree on error
-        if ldap_root:
-            return ldap_root
-        else:
-            # Create empty tree as fallback
-            root = ReadOnlyInMemoryLDAPEntry(
-                dn=b"dc=schule,dc=lan",
-                attributes={b"objectClass": [b"domain"], b"dc": [b"schule"]}
-            )
-            return root
+        return gal_tree.root
 
 # ------------------------------------------------------------
 # FACTORY / SERVER IMPLEMENTATION
@@ -307,9 +538,16 @@ class InMemoryLDAPFactory(Factory):
         self.update_tree()
 
     def update_tree(self):
-        """Rebuild LDAP tree from SQL"""
+        """Rebuild LDAP tree from SQL (blocking, used on startup)"""
         self.root = build_ldap_tree_from_sql()
 
+    def refresh_tree(self):
+        """Update LDAP tree from SQL in a worker thread, so searches on the reactor are not blocked"""
+        d = threads.deferToThread(compute_ldap_tree_update)
+        d.addCallback(apply_ldap_tree_update)
+        d.addErrback(log_ldap_tree_error)
+        return d
+
     def buildProtocol(self, addr):
         proto = LDAPServer()
         proto.factory = self
@@ -345,7 +583,7 @@ if __name__ == '__main__':
     factory = InMemoryLDAPFactory()
 
     # Rebuild tree every 60 seconds to pick up SQL changes
-    refresh_task = task.LoopingCall(factory.update_tree)
+    refresh_task = task.LoopingCall(factory.refresh_tree)
     refresh_task.start(60.0, now=False)
 
     reactor.listenTCP(3890, factory, interface='0.0.0.0')
@@ -356,6 +594,7 @@ if __name__ == '__main__':
     logger.info("Data source: MySQL edulution_gal table")
     logger.info("Refresh interval: 60 seconds")
     logger.info(f"Debug logging: {'ENABLED' if LDAP_DEBUG else 'DISABLED'}")
+    logger.info(f"Search indexes: {'ENABLED' if LDAP_SEARCH_INDEX else 'DISABLED'}")
     logger.info("=" * 60)
 
     reactor.run()